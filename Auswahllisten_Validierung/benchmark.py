@@ -0,0 +1,177 @@
+"""
+Benchmark for the cross reference of Auswahllisten_Validierung.
+
+Generates a synthetic reference file and data collection file, checks that every variant of Data.cross_reference
+finds exactly the same issues and compares the time they take: cell by cell (the default), columnar (columnar=True),
+and both on a workbook opened read-only (row by row resp. columnar). Loading the data file is timed separately.
+    > python benchmark.py
+    > python benchmark.py --rows 50000 --repetitions 5
+"""
+
+from excel import Data, Reference
+from typing import Any, Dict, List, Tuple
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import openpyxl as xl
+import argparse
+import random
+import os
+
+VARIANTS = [
+    ("cells", False, False),
+    ("columnar", False, True),
+    ("rows (read-only)", True, False),
+    ("columnar (read-only)", True, True)
+]
+
+
+def generate_reference(filename: str, entries: int, seed: int = 0) -> Dict[str, List[Any]]:
+    """
+    Write a reference file with entries values in each column of Reference.columns
+
+    :param filename: path of the xlsx file to be written
+    :param entries: number of values per column
+    :param seed: seed for the random number generator
+    :return: values of each reference column, by title
+    """
+    generator = random.Random(seed)
+    workbook = xl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = Reference.sheet_name
+
+    values: Dict[str, List[Any]] = {}
+    for ref_col in Reference.columns:
+        worksheet.cell(row=1, column=ref_col.index).value = ref_col.header
+        # Numbers as well, which are compared by their text
+        values[ref_col.title] = [generator.randint(1, 10 * entries) if generator.random() < 0.2 else
+                                 f"{ref_col.title} {number}" for number in range(entries)]
+
+        for row_nr, value in enumerate(values[ref_col.title], start=Reference.min_row):
+            worksheet.cell(row=row_nr, column=ref_col.index).value = value
+
+    workbook.save(filename)
+    return values
+
+
+def generate_data(filename: str, rows: int, reference_values: Dict[str, List[Any]], error_rate: float = 0.05,
+                  seed: int = 0) -> None:
+    """
+    Write a data collection file whose columns associated with the reference mostly contain values of the reference
+
+    :param filename: path of the xlsx file to be written
+    :param rows: number of rows
+    :param reference_values: values of each reference column as returned by generate_reference
+    :param error_rate: share of values that are not in the reference, empty or padded with spaces
+    :param seed: seed for the random number generator
+    """
+    generator = random.Random(seed)
+    workbook = xl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = Data.sheet_name
+
+    reference_headers = {ref_col.header: ref_col.title for ref_col in Reference.columns}
+    for data_col in Data.columns:
+        worksheet.cell(row=1, column=data_col.index).value = data_col.header
+
+    for row_nr in range(Data.min_row, Data.min_row + rows):
+        # Some empty rows in between, which are checked as well
+        if generator.random() < 0.001:
+            continue
+
+        for data_col in Data.columns:
+            title = reference_headers.get(data_col.header)
+            if title is None:
+                value = f"{data_col.title} {generator.randrange(1000)}"
+            elif generator.random() >= error_rate:
+                value = generator.choice(reference_values[title])
+                if title == "einsatz":
+                    # Only the last of the comma separated entries is checked
+                    value = f"{generator.choice(reference_values[title])}, {value}"
+            else:
+                value = generator.choice([None, f"unknown {generator.randrange(100)}",
+                                          f" {generator.choice(reference_values[title])} "])
+
+            worksheet.cell(row=row_nr, column=data_col.index).value = value
+
+    workbook.save(filename)
+
+
+def best_time(func, repetitions: int) -> Tuple[float, Any]:
+    """
+    Call func repeatedly and measure the fastest call
+
+    :param func: function to be timed, called without arguments
+    :param repetitions: number of calls
+    :return: time of the fastest call in seconds and the result of the last call
+    """
+    times: List[float] = []
+    result = None
+
+    for _ in range(repetitions):
+        start = perf_counter()
+        result = func()
+        times.append(perf_counter() - start)
+
+    return min(times), result
+
+
+def benchmark_cross_reference(rows: int, entries: int, repetitions: int) -> None:
+    """
+    Compare the variants of Data.cross_reference on generated files and print the results
+
+    :param rows: number of rows of the generated data collection file
+    :param entries: number of values per column of the generated reference file
+    :param repetitions: number of timed calls per variant
+    """
+    with TemporaryDirectory() as directory:
+        reference_filename = os.path.join(directory, "reference.xlsx")
+        data_filename = os.path.join(directory, "data.xlsx")
+
+        generate_data(data_filename, rows, generate_reference(reference_filename, entries))
+        reference = Reference(reference_filename, use_cache=False)
+
+        results: Dict[str, Dict[str, List[Tuple[int, Any]]]] = {}
+        print(f"{rows} rows, {entries} reference values per column, best of {repetitions}:")
+
+        for name, read_only, columnar in VARIANTS:
+            load_seconds, data = best_time(lambda: Data(data_filename, read_only=read_only), 1)
+            try:
+                if read_only:
+                    # Read-only worksheets can only be iterated once, every call needs a newly opened workbook
+                    def cross_reference():
+                        data_read_only = Data(data_filename, read_only=True)
+                        try:
+                            start = perf_counter()
+                            issues = data_read_only.cross_reference(reference, columnar=columnar)
+                            return perf_counter() - start, issues
+                        finally:
+                            data_read_only.close()
+
+                    timings = [cross_reference() for _ in range(repetitions)]
+                    seconds, issues = min(seconds for seconds, _ in timings), timings[-1][1]
+                else:
+                    seconds, issues = best_time(lambda: data.cross_reference(reference, columnar=columnar),
+                                                repetitions)
+            finally:
+                data.close()
+
+            results[name] = {data_col.title: found for data_col, found in issues.items()}
+            print(f"\t{name + ':':22}load {load_seconds:7.3f}s   cross_reference {seconds:7.3f}s   "
+                  f"{sum(map(len, results[name].values()))} issues")
+
+        reference_name = VARIANTS[0][0]
+        for name, found in results.items():
+            if found != results[reference_name]:
+                raise AssertionError(f"{name} found other issues than {reference_name}.")
+        print("All variants found the same issues.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark for the cross reference of Auswahllisten_Validierung.")
+    parser.add_argument("--rows", type=int, default=20000, help="number of rows of the generated data file")
+    parser.add_argument("--entries", type=int, default=300, help="number of values per reference column")
+    parser.add_argument("--repetitions", type=int, default=3, help="number of timed calls per variant")
+
+    arguments = parser.parse_args()
+
+    benchmark_cross_reference(arguments.rows, arguments.entries, arguments.repetitions)
@@ -2,8 +2,38 @@ from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl.utils import column_index_from_string
 from openpyxl.worksheet.worksheet import Worksheet
 import openpyxl as xl
-from typing import Optional, Tuple, Dict, List, Any
+from typing import Optional, Tuple, Dict, List, Any, FrozenSet, Pattern
 import io
+import json
+import os
+import re
+import sys
+from itertools import compress
+from operator import not_
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_utils import get_column_values, get_file_hash, get_last_row
+
+
+def partial_match_pattern(entries) -> str:
+    # Regular expression that finds any of the entries, with common prefixes merged into a trie, so each position of a
+    # value is checked against the next character of all entries at once instead of against every entry in turn
+    trie: Dict[str, Dict] = {}
+    for entry in entries:
+        node = trie
+        for char in entry:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node: Dict[str, Dict]) -> str:
+        if "" in node:
+            # Any value containing a longer entry contains this one as well
+            return ""
+
+        alternatives = [re.escape(char) + to_pattern(child) for char, child in sorted(node.items())]
+        return alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+
+    return to_pattern(trie)
 
 
 class Column:
@@ -31,6 +61,10 @@ class ReferenceColumn(Column):
         self.match_partial = match_partial
         self.data: List = []
 
+        # Built from data by set_data, used by validate
+        self._values: FrozenSet[str] = frozenset()
+        self._partial_pattern: Optional[Pattern] = None
+
     def set_data(self, data):
         self.data = map(lambda elem: str(elem).strip(), set(data))
         self.data = list(filter(lambda x: x not in ["", str(None)], self.data))
@@ -38,23 +72,51 @@ class ReferenceColumn(Column):
         if self.allow_empty and str(None) not in self.data:
             self.data.append(str(None))
 
-    def validate(self, value):
+        self._values = frozenset(self.data)
+        self._partial_pattern = None if len(self.data) == 0 else re.compile(partial_match_pattern(self._values))
+
+    def clean(self, value) -> str:
         if self.csv_take_last:
             value = str(value).split(",")[-1]
-        value_cleaned = str(value).strip()
+        return str(value).strip()
+
+    def validate(self, value):
+        value_cleaned = self.clean(value)
 
         if self.match_partial:
-            for entry in self.data:
-                if entry in value_cleaned:
-                    return True
-            return False
+            return self._matches_partial(value_cleaned)
 
-        return value_cleaned in self.data  # True if there is matching value in data list, False otherwise
+        return value_cleaned in self._values  # True if there is matching value in data list, False otherwise
+
+    def invalid_indices(self, values: List) -> List[int]:
+        # Indices of the values that do not validate, checks a whole column at once
+        if self.match_partial or self.csv_take_last:
+            indices = range(len(values))
+        else:
+            # Values found in the data as they are are valid, only the remaining ones need to be cleaned
+            indices = list(compress(range(len(values)), map(not_, map(self._values.__contains__, values))))
+
+        if self.csv_take_last:
+            values_cleaned = [str(values[index]).split(",")[-1].strip() for index in indices]
+        else:
+            values_cleaned = [str(values[index]).strip() for index in indices]
+
+        # Every distinct value is validated once
+        distinct_values = set(values_cleaned)
+        if self.match_partial:
+            invalid_values = {value_cleaned for value_cleaned in distinct_values
+                              if not self._matches_partial(value_cleaned)}
+        else:
+            invalid_values = distinct_values - self._values
+
+        return [index for index, value_cleaned in zip(indices, values_cleaned) if value_cleaned in invalid_values]
+
+    def _matches_partial(self, value_cleaned: str) -> bool:
+        # True if any entry of data is part of the value
+        return self._partial_pattern is not None and self._partial_pattern.search(value_cleaned) is not None
 
     def get_validator(self):
-        values = self.data
-        if str(None) in values:
-            values.remove(str(None))
+        values = [value for value in self.data if value != str(None)]
 
         return DataValidation(type="list", formula1=";".join(map(str, values)),
                               allow_blank=self.allow_empty, showDropDown=False)
@@ -73,29 +135,37 @@ class _Excel:
     columns: Optional[Column] = None
     sheet_name: Optional[str] = None
 
-    def __init__(self, filename):
+    def __init__(self, filename, read_only=False, load=True):
+        self.filename = filename
         self.workbook: Optional[xl.Workbook] = None
         self.worksheet: Optional[Worksheet] = None
+        self.read_only = read_only
 
-        self._load_file(filename)
+        if load:
+            self._load_file(filename)
 
     def _load_file(self, filename):
-        with open(filename, "rb") as in_stream:
-            file_mem = io.BytesIO(in_stream.read())
-
-        self.workbook = xl.load_workbook(file_mem, data_only=True)
+        if self.read_only:
+            # Rows are parsed from the file while they are iterated, only the current row is kept in memory
+            self.workbook = xl.load_workbook(filename, read_only=True, data_only=True)
+        else:
+            with open(filename, "rb") as in_stream:
+                file_mem = io.BytesIO(in_stream.read())
+
+            self.workbook = xl.load_workbook(file_mem, data_only=True)
         self.worksheet = self.workbook[self.sheet_name]
 
-    def max_row(self):
-        row_count = 0
-        for row_nr, row in enumerate(self.worksheet.iter_rows()):
-            if any([cell.value is not None for cell in row]):
-                row_count = row_nr
+    def close(self):
+        # Read-only workbooks keep their file open until closed
+        if self.workbook is not None:
+            self.workbook.close()
 
-        return row_count
+    def max_row(self):
+        # Index of the last non-empty row, counted from 0
+        return max(get_last_row(self.worksheet) - 1, 0)
 
     def __str__(self):
-        return f"{self.__class__.__name__}(workbook_path={self.workbook.path}, worksheet={self.sheet_name})"
+        return f"{self.__class__.__name__}(workbook_path={self.filename}, worksheet={self.sheet_name})"
 
 
 class Reference(_Excel):
@@ -118,14 +188,29 @@ class Reference(_Excel):
     sheet_name = "Auswahllisten-nichts löschen!"
     min_row = 2
 
-    def __init__(self, filename):
-        super().__init__(filename)
+    # Column data of the last cache_entries reference files, keyed by their hash. Kept in the cache directory of the
+    # user (%LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or ~/.cache elsewhere), so it is shared by all runs regardless of
+    # the working directory and stays out of the source tree
+    cache_file = os.path.join(os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or
+                              os.path.join(os.path.expanduser("~"), ".cache"),
+                              "Auswahllisten_Validierung", "reference_cache.json")
+    cache_entries = 8
+
+    def __init__(self, filename, use_cache=True):
+        self._column_titles = [column.title for column in self.columns]
+        self._column_headers = [column.header for column in self.columns]
+        self._file_hash = get_file_hash(filename)
+
+        # A reference file that was read before is not opened again
+        cached = use_cache and self.load_cache()
+        super().__init__(filename, load=not cached)
 
-        self._row_count = self.max_row()
-        self._column_titles = map(lambda x: x.title, self.columns)
-        self._column_headers = map(lambda x: x.header, self.columns)
+        if not cached:
+            self._row_count = self.max_row()
+            self.load_data()
 
-        self.load_data()
+            if use_cache:
+                self.save_cache()
 
     def load_data(self):
         for ref_col in self.columns:
@@ -138,6 +223,52 @@ class Reference(_Excel):
 
         col.set_data(data)
 
+    def _cache_signature(self):
+        # Cached column data is only used with the same column definitions
+        return [self.sheet_name, self.min_row] + \
+            [[ref_col.title, ref_col.name, ref_col.allow_empty] for ref_col in self.columns]
+
+    def _read_cache(self) -> Dict[str, Dict[str, List[str]]]:
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as in_stream:
+                cache = json.load(in_stream)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(cache, dict) or cache.get("signature") != self._cache_signature():
+            return {}
+        return cache.get("entries", {})
+
+    def load_cache(self) -> bool:
+        column_data = self._read_cache().get(self._file_hash)
+        if column_data is None or any(ref_col.title not in column_data for ref_col in self.columns):
+            return False
+
+        for ref_col in self.columns:
+            ref_col.set_data(column_data[ref_col.title])
+        return True
+
+    def save_cache(self):
+        entries = self._read_cache()
+        entries.pop(self._file_hash, None)
+        entries[self._file_hash] = {ref_col.title: ref_col.data for ref_col in self.columns}
+        entries = dict(list(entries.items())[-self.cache_entries:])
+
+        # Written to a temporary file first, so an interrupted run does not leave a broken cache behind
+        temp_file = self.cache_file + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(temp_file, "w", encoding="utf-8") as out_stream:
+                json.dump({"signature": self._cache_signature(), "entries": entries}, out_stream, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+        except OSError as error:
+            # The cache only saves time, a location that can not be written (e.g. read-only) is used without it
+            print(f"Referenz-Cache {self.cache_file} konnte nicht geschrieben werden: {error}", file=sys.stderr)
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+
     def column_by_title(self, title):
         matches = list(filter(lambda x: x.title == title, self.columns))
 
@@ -214,12 +345,13 @@ class Data(_Excel):
     sheet_name = "Chemicals register"
     min_row = 3
 
-    def __init__(self, filename):
-        super().__init__(filename)
+    def __init__(self, filename, read_only=False):
+        super().__init__(filename, read_only)
 
-        self._row_count = self.max_row() + 1
-        self._column_titles = map(lambda x: x.title, self.columns)
-        self._column_headers = map(lambda x: x.header, self.columns)
+        # Read-only worksheets are only read once, by cross_reference, which finds the last row itself
+        self._row_count = None if read_only else self.max_row() + 1
+        self._column_titles = [column.title for column in self.columns]
+        self._column_headers = [column.header for column in self.columns]
 
     def column_by_title(self, title):
         matches = list(filter(lambda x: x.title == title, self.columns))
@@ -271,9 +403,15 @@ class Data(_Excel):
 
     def cross_reference(self, reference: Reference,
                         subset_header: Optional[List[str]] = None,
-                        subset_title: Optional[List[str]] = None):
+                        subset_title: Optional[List[str]] = None,
+                        columnar: bool = False):
         data_reference_assoc = self.get_associated_columns(reference, subset_header, subset_title)
 
+        if columnar:
+            return self._cross_reference_columns(data_reference_assoc)
+        if self.read_only:
+            return self._cross_reference_rows(data_reference_assoc)
+
         # Initialize empty dictionary for storing found discrepancies
         issues: Dict[Column, List[Tuple[int, Any]]] = {}
 
@@ -291,9 +429,76 @@ class Data(_Excel):
 
         return issues
 
+    def _cross_reference_rows(self, data_reference_assoc: List[Tuple[DataColumn, ReferenceColumn]]):
+        # Same result as cross_reference, but all associated columns are validated row by row in a single pass over
+        # the worksheet
+        issues: Dict[Column, List[Tuple[int, Any]]] = {data_col: [] for data_col, _ in data_reference_assoc}
+        columns = [(data_col, data_col.index - 1, reference_col) for data_col, reference_col in data_reference_assoc]
+
+        # Empty rows only count if a non-empty row follows, rows after the last non-empty row are not checked
+        empty_row_issues = [data_col for data_col, _, reference_col in columns if not reference_col.validate(None)]
+        empty_rows: List[int] = []
+
+        for row_nr, row in enumerate(self.worksheet.iter_rows(min_row=self.min_row, values_only=True),
+                                     start=self.min_row):
+            if all(value is None for value in row):
+                empty_rows.append(row_nr)
+                continue
+
+            for empty_row_nr in empty_rows:
+                for data_col in empty_row_issues:
+                    issues[data_col].append((empty_row_nr, None))
+            empty_rows.clear()
+
+            for data_col, column, reference_col in columns:
+                value = row[column] if column < len(row) else None
+
+                if not reference_col.validate(value):
+                    issues[data_col].append((row_nr, value))
+
+        return issues
+
+    def _cross_reference_columns(self, data_reference_assoc: List[Tuple[DataColumn, ReferenceColumn]]):
+        # Same result as cross_reference. The associated columns are read into lists first, then each column is checked
+        # as a whole by ReferenceColumn.invalid_indices
+        columns: List[List[Any]] = [[] for _ in data_reference_assoc]
+        if len(columns) == 0:
+            return {}
+
+        if self._row_count is not None:
+            # The last non-empty row is known already, only the associated columns are read
+            columns = [get_column_values(self.worksheet, data_col.index, self.min_row, self._row_count)
+                       for data_col, _ in data_reference_assoc]
+            last_row_nr = max(self._row_count, self.min_row - 1)
+        else:
+            column_indices = [data_col.index - 1 for data_col, _ in data_reference_assoc]
+
+            last_row_nr = self.min_row - 1
+            for row_nr, row in enumerate(self.worksheet.iter_rows(min_row=self.min_row, values_only=True),
+                                         start=self.min_row):
+                for values, column_index in zip(columns, column_indices):
+                    values.append(row[column_index] if column_index < len(row) else None)
+
+                if any(value is not None for value in row):
+                    last_row_nr = row_nr
+
+        # Rows after the last non-empty row are not checked
+        row_nrs = range(self.min_row, last_row_nr + 1)
+
+        issues: Dict[Column, List[Tuple[int, Any]]] = {}
+        for (data_col, reference_col), values in zip(data_reference_assoc, columns):
+            del values[len(row_nrs):]
+
+            issues[data_col] = [(row_nrs[index], values[index]) for index in reference_col.invalid_indices(values)]
+
+        return issues
+
     def add_data_validations(self, reference: Reference,
                              subset_header: Optional[List[str]] = None,
                              subset_title: Optional[List[str]] = None):
+        if self.read_only:
+            raise RuntimeError("Data validations can not be added to a workbook opened read-only.")
+
         data_reference_assoc = self.get_associated_columns(reference, subset_header, subset_title)
 
         for data_col, reference_col in data_reference_assoc:
@@ -302,6 +507,9 @@ class Data(_Excel):
             data_col.add_validator(validator, self._row_count)
 
     def save_copy(self, filename: str):
+        if self.read_only:
+            raise RuntimeError("A workbook opened read-only can not be saved.")
+
         self.workbook.save(filename=filename)
 
     def __getattr__(self, item):
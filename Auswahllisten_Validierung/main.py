@@ -3,6 +3,20 @@ from excel import Data, Reference
 from tkinter.filedialog import askopenfilename, asksaveasfilename
 from tkinter import Tk
 
+from glob import glob
+from multiprocessing import Pool, cpu_count
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import csv
+import json
+import os
+
+REPORT_FORMATS = ("csv", "json")
+REPORT_COLUMNS = ("file", "column", "header", "row", "value", "error")
+
+# Reference used by check_file, set once per worker process by init_worker
+_reference: Optional[Reference] = None
+
 
 def check_data(data: Data, reference: Reference):
     issues = data.cross_reference(reference)
@@ -34,12 +48,126 @@ def main():
     data_filename = askopenfilename(title="Open data file...", filetypes=[("Microsoft Excel File", "*.xlsx")])
     root.destroy()
 
-    data = Data(data_filename)
+    # Checking only reads the data file once, create_data_validations needs it opened with read_only=False
+    data = Data(data_filename, read_only=True)
     reference = Reference(reference_filename)
 
     check_data(data, reference)
     # create_data_validations(data, reference)
 
+    data.close()
+
+
+def collect_data_files(inputs: List[str]) -> List[str]:
+    # Directories are searched recursively, all other inputs are glob patterns. Only .xlsx files are checked, Excel
+    # lock files (~$...) are skipped
+    filenames = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                filenames.update(os.path.join(directory, name) for name in names)
+        else:
+            filenames.update(filename for filename in glob(path, recursive=True) if os.path.isfile(filename))
+
+    return sorted((filename for filename in filenames if filename.lower().endswith(".xlsx") and
+                   not os.path.basename(filename).startswith("~$")), key=str.casefold)
+
+
+def init_worker(reference_filename: str):
+    global _reference
+    # Forked workers inherit the reference of the main process, spawned ones read the column data compiled by the main
+    # process from the reference cache, the file is not parsed again
+    if _reference is None:
+        _reference = Reference(reference_filename)
+
+
+def check_file(data_filename: str) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+    try:
+        data = Data(data_filename, read_only=True)
+        try:
+            issues = data.cross_reference(_reference)
+        finally:
+            data.close()
+    except Exception as error:
+        return data_filename, [], repr(error)
+
+    rows = [{"file": data_filename, "column": column.name, "header": column.header.replace("\n", " ").strip(),
+             "row": row_nr, "value": value}
+            for column, discrepancies in issues.items() for row_nr, value in discrepancies]
+    return data_filename, rows, None
+
+
+def write_report(report: str, report_format: str, results: List[Tuple[str, List[Dict[str, Any]], Optional[str]]]):
+    with open(report, "w", encoding="utf-8", newline="") as out_stream:
+        if report_format == "json":
+            json.dump({"files": [{"file": filename, "issues": len(rows), "error": error}
+                                 for filename, rows, error in results],
+                       "issues": [row for _, rows, _ in results for row in rows]},
+                      out_stream, ensure_ascii=False, indent=1, default=str)
+            return
+
+        writer = csv.writer(out_stream, delimiter=";")
+        writer.writerow(REPORT_COLUMNS)
+        for filename, rows, error in results:
+            if error is not None:
+                writer.writerow([filename, "", "", "", "", error])
+            for row in rows:
+                writer.writerow([row["file"], row["column"], row["header"], row["row"], row["value"], ""])
+
+
+def run_batch(reference_filename: str, inputs: List[str], report: str, report_format: Optional[str], workers: int):
+    global _reference
+
+    data_filenames = collect_data_files(inputs)
+    if report_format is None:
+        extension = report.split(".")[-1].lower()
+        report_format = extension if extension in REPORT_FORMATS else "csv"
+
+    # Compiles the reference once and stores it in the reference cache for the worker processes
+    _reference = Reference(reference_filename)
+
+    pool = None
+    if workers > 1 and len(data_filenames) > 1:
+        pool = Pool(min(workers, len(data_filenames)), initializer=init_worker, initargs=(reference_filename,))
+
+    results = []
+    try:
+        checked_files = map(check_file, data_filenames) if pool is None else \
+            pool.imap_unordered(check_file, data_filenames)
+
+        for number, (filename, rows, error) in enumerate(checked_files):
+            print(f"[{number + 1}/{len(data_filenames)}] {filename}: " +
+                  (f"Fehler ({error})" if error is not None else f"{len(rows)} Probleme"))
+            results.append((filename, rows, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Files are reported in the order they were found in, regardless of which worker finished first
+    results.sort(key=lambda result: result[0].casefold())
+    write_report(report, report_format, results)
+
+    print(f"\n{len(data_filenames)} Dateien geprüft, {sum(len(rows) for _, rows, _ in results)} Probleme, "
+          f"{sum(error is not None for _, _, error in results)} Dateien mit Fehlern")
+    print(f"Bericht: {report}")
+
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Check data files against the selection lists of a reference file. "
+                                                 "Without arguments, both files are selected interactively.")
+    parser.add_argument("reference", nargs="?", help="reference file for checking data files without user interaction")
+    parser.add_argument("inputs", nargs="*",
+                        help="directories (searched recursively) and glob patterns of the data files to check")
+    parser.add_argument("-o", "--output", default="report.csv",
+                        help="report file listing file, column, row and value of every issue (default: %(default)s)")
+    parser.add_argument("-f", "--format", choices=REPORT_FORMATS,
+                        help="format of the report file (default: derived from its extension, otherwise csv)")
+    parser.add_argument("-j", "--workers", type=int, default=cpu_count(),
+                        help="number of worker processes for checking data files (default: %(default)s)")
+    arguments = parser.parse_args()
+
+    if arguments.reference is None:
+        main()
+    else:
+        run_batch(arguments.reference, arguments.inputs, arguments.output, arguments.format, arguments.workers)
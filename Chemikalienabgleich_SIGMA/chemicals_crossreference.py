@@ -1,17 +1,32 @@
 import os
 from os import PathLike
 from os.path import basename
-from typing import Union, Any
+from typing import Union, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+from contextlib import contextmanager, redirect_stdout
+from itertools import islice
+from math import ceil
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
 
 from tkinter.filedialog import askopenfilenames
 from tkinter import Tk
 
 import openpyxl as xl
 import csv
+import hashlib
+import io
+import json
+import re
 import sqlite3 as sql
+import sys
 
 from openpyxl.utils import column_index_from_string
 
+# Helpers shared by the scripts of this repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_utils import get_file_hash, get_last_row
+
+DATABASE_FILE = "db.sqlite"
 TABLE_NAME = "data"
 DATACOLLECTION_SHEET_NAME = "Chemicals register"
 DATACOLLECTION_PRODUCT_ID_COLUMN = "D"
@@ -19,6 +34,18 @@ DATACOLLECTION_MARKER_COLUMN = "AQ"
 DATA_PRODUCER_COLUMN = "hersteller"
 DATA_PRODUCER_ALL = "alle Hersteller"
 
+# Rows are inserted in batches of INSERT_BATCH_SIZE, progress is printed every PROGRESS_INTERVAL rows
+INSERT_BATCH_SIZE = 5000
+PROGRESS_INTERVAL = 20000
+# Pragmas set while loading data files, which are inserted in a single transaction each. The rollback journal is kept,
+# so an import interrupted by a crash is rolled back the next time the database is opened. With fewer syncs to the disk,
+# a power failure during an import may lose it and, on some file systems, damage the database (delete DATABASE_FILE and
+# import the data files again)
+BULK_LOAD_PRAGMAS = {"synchronous": "NORMAL"}
+
+# Columns of the data table matched against the data collection sheet, as (column in data table, column in data
+# collection sheet, max offset). Columns with a max offset match numbers that differ by less than it, rows of the data
+# collection sheet without a number in such a column (empty or not a number) match regardless of it
 CONCENTRATION_MAX_OFFSET = 2
 CROSS_REFERENCES = [
     ("handelsname", "A", 0),
@@ -26,10 +53,70 @@ CROSS_REFERENCES = [
     ("konzentration_prozent", "G", CONCENTRATION_MAX_OFFSET)
 ]
 
+# Columns queried by the cross reference are stored a second time in normalized form, indexed by
+# CROSS_REFERENCE_INDEX. Columns with a max offset are stored as numbers, all others as text normalized by
+# COLUMN_NORMALIZERS (normalize_text by default)
+NORMALIZED_COLUMN_SUFFIX = "_norm"
+CROSS_REFERENCE_INDEX = f"{TABLE_NAME}_cross_reference"
+
+# Match all rows of a data collection sheet with a single query joining them (stored in the temporary table
+# CANDIDATES_TABLE_NAME) with the data table, instead of one query per row
+BATCH_MATCHING = True
+CANDIDATES_TABLE_NAME = "candidates"
+
+# The imported data files are listed with their hash and modification time in SOURCES_TABLE_NAME. Selecting them again
+# only imports files that changed. Rows are identified by their file and the values of ROW_KEY_COLUMNS (the product, by
+# default), numbered by their occurrence if the values repeat within the file, so identical rows are all kept. Rows whose
+# other columns changed (e.g. the statements) are updated in place, rows with changed key values are inserted anew and
+# rows no longer in the file are deleted. Key columns missing in a file are left out, all columns are used if none or
+# ROW_KEY_COLUMNS is empty
+SOURCES_TABLE_NAME = "sources"
+ROW_KEY_COLUMNS = [DATA_PRODUCER_COLUMN, "handelsname", "cas_nr", "konzentration_prozent"]
+SOURCE_COLUMNS = [
+    ("source_file", "TEXT"),
+    ("row_key", "TEXT"),
+    ("import_id", "INTEGER")
+]
+
+# Trade names of the data collection sheet that are not in the data table are replaced by the most similar trade name or
+# synonym (SYNONYM_COLUMNS, separated by "," or ";") of the data table, if their trigram similarity (Dice coefficient)
+# is at least FUZZY_MATCHING_THRESHOLD. The trigrams of all names are indexed when the data table changes
+FUZZY_MATCHING = False
+FUZZY_MATCHING_THRESHOLD = 0.8
+TRADE_NAME_COLUMN = "handelsname"
+SYNONYM_COLUMNS = ["synonyme"]
+TRADE_NAMES_TABLE_NAME = "trade_names"
+TRADE_NAME_TRIGRAMS_TABLE_NAME = "trade_name_trigrams"
+TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME = "trade_name_trigram_counts"
+
+# Statements copied from the best match (lowest concentration deviation) into matched rows of the data collection
+# sheet, as (column in data table, column in data collection sheet). Rows that already contain H-Statements are kept
+STATEMENT_COLUMNS = [
+    ("h_saetze", "I"),
+    ("p_saetze", "J"),
+    ("euh_saetze", "K")
+]
+
+# Schema of the data table. With PRUNE_COLUMNS, only the columns used for the cross reference, STATEMENT_COLUMNS and
+# SYNONYM_COLUMNS are stored. Columns in COLUMN_TYPES are stored with the given type instead of TEXT, numeric values are
+# converted when imported. WITHOUT_ROWID stores the rows ordered by their row_key instead of an id. The table is
+# rebuilt when these settings change, the current ones are kept in SETTINGS_TABLE_NAME
+PRUNE_COLUMNS = True
+COLUMN_TYPES = {
+    "konzentration_prozent": "REAL"
+}
+NUMERIC_COLUMN_TYPES = ["REAL", "INTEGER", "NUMERIC"]
+WITHOUT_ROWID = False
+SETTINGS_TABLE_NAME = "settings"
+
+# With PARALLEL_PROCESSING, multiple data collection files are processed by up to MAX_WORKERS processes at once
+PARALLEL_PROCESSING = True
+MAX_WORKERS = cpu_count()
 
 
-def load_worksheet(path_to_excel: Union[PathLike, str], worksheet_name: Union[str, int]):
-    workbook: xl.Workbook = xl.load_workbook(path_to_excel, data_only=True)
+
+def load_worksheet(path_to_excel: Union[PathLike, str], worksheet_name: Union[str, int], read_only: bool = False):
+    workbook: xl.Workbook = xl.load_workbook(path_to_excel, data_only=True, read_only=read_only)
 
     if isinstance(worksheet_name, int):
         worksheet = workbook.worksheets[worksheet_name]
@@ -39,25 +126,6 @@ def load_worksheet(path_to_excel: Union[PathLike, str], worksheet_name: Union[st
     return workbook, worksheet
 
 
-def get_worksheet_line_count(worksheet):
-    max_row = 0
-    for row_nr, row in enumerate(worksheet.iter_rows()):
-        if any([cell.value is not None for cell in row]):
-            max_row = row_nr
-        else:
-            pass
-
-    return max_row
-
-
-def excel_to_csv(worksheet, output_file: Union[PathLike, str]) -> None:
-    with open(output_file, "w", newline="", encoding="utf-8") as out_stream:
-        writer = csv.writer(out_stream, delimiter=";")
-
-        for row in worksheet.iter_rows(values_only=True):
-            writer.writerow(row)
-
-
 def parse_header(text: str) -> str:
     return text.lower().strip().\
         replace(".", "").\
@@ -69,39 +137,268 @@ def parse_header(text: str) -> str:
         replace("ü", "ue")
 
 
-def create_table_from_csv(connection: sql.Connection, csv_file: Union[PathLike, str], table_name: str) -> None:
-    with open(csv_file, "r", encoding="utf-8") as in_stream:
-        reader = csv.DictReader(in_stream, delimiter=";")
-        column_headers = reader.fieldnames
+def get_required_columns() -> Set[str]:
+    return {DATA_PRODUCER_COLUMN, TRADE_NAME_COLUMN} | \
+           {column_name for (column_name, _, _) in CROSS_REFERENCES} | \
+           {column_name for (column_name, _) in STATEMENT_COLUMNS} | \
+           set(SYNONYM_COLUMNS)
+
+
+def get_stored_columns(column_names: List[str]) -> List[Tuple[int, str, str]]:
+    # Index in the data file, name and type of the columns of a data file that are stored in the data table
+    required_columns = get_required_columns()
+    return [(column_index, column_name, COLUMN_TYPES.get(column_name, "TEXT"))
+            for (column_index, column_name) in enumerate(column_names)
+            if not PRUNE_COLUMNS or column_name in required_columns]
+
+
+def get_row_id_column() -> str:
+    return "row_key" if WITHOUT_ROWID else "id"
+
+
+def get_schema() -> str:
+    return json.dumps({"prune_columns": sorted(get_required_columns()) if PRUNE_COLUMNS else None,
+                       "column_types": COLUMN_TYPES,
+                       "without_rowid": WITHOUT_ROWID}, sort_keys=True)
+
 
-    column_headers_parsed = [parse_header(header) for header in column_headers]
-    print(column_headers_parsed)
+def create_table(connection: sql.Connection, column_names: List[str], table_name: str, source_name: str) -> None:
+    stored_columns = get_stored_columns(column_names)
+    print([f"{column_name} {column_type}" for (_, column_name, column_type) in stored_columns])
 
-    print(f"GENERATING DATABASE TABLE WITH {len(column_headers_parsed)} COLUMNS FROM HEADER OF {basename(csv_file)}... ", end="")
+    print(f"GENERATING DATABASE TABLE WITH {len(stored_columns)} COLUMNS FROM HEADER OF {source_name}... ", end="")
 
-    connection.execute(f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY, {','.join([f'{column_header} TEXT' for column_header in column_headers_parsed])});")
+    column_definitions = ", ".join([f"{column_name} {column_type}" for (_, column_name, column_type) in stored_columns])
+    if WITHOUT_ROWID:
+        # Rows are stored in the b-tree of their key, the upserts of refresh_table need no separate index
+        connection.execute(f"CREATE TABLE {table_name} (row_key TEXT PRIMARY KEY, {column_definitions}) WITHOUT ROWID;")
+    else:
+        connection.execute(f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY, {column_definitions});")
     connection.commit()
 
     print("DONE")
 
 
-def populate_table(connection: sql.Connection, csv_file: Union[PathLike, str], table_name: str) -> None:
-    cursor: sql.Cursor = connection.cursor()
+@contextmanager
+def bulk_load(connection: sql.Connection):
+    previous_pragmas = {pragma: connection.execute(f"PRAGMA {pragma};").fetchone()[0] for pragma in BULK_LOAD_PRAGMAS}
+
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        connection.execute(f"PRAGMA {pragma} = {value};")
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        # Rows of a load that failed halfway are not kept
+        connection.rollback()
+        raise
+    finally:
+        for pragma, value in previous_pragmas.items():
+            connection.execute(f"PRAGMA {pragma} = {value};")
+
+
+def batched(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def insert_rows(connection: sql.Connection, table_name: str, column_names: List[str], rows: Iterable[Tuple],
+                source_name: str, upsert_key: Optional[str] = None) -> int:
+    statement = f"INSERT INTO {table_name} ({','.join(column_names)}) VALUES ({','.join(['?' for _ in column_names])})"
+    if upsert_key is not None:
+        # Rows with a known key are updated in place, keeping their id
+        statement += f" ON CONFLICT({upsert_key}) DO UPDATE SET " + \
+                     ",".join([f"{column_name} = excluded.{column_name}"
+                               for column_name in column_names if column_name != upsert_key])
+    statement += ";"
+    row_count = 0
+    next_progress = PROGRESS_INTERVAL
+
+    with bulk_load(connection):
+        for batch in batched(rows, INSERT_BATCH_SIZE):
+            connection.executemany(statement, batch)
+            row_count += len(batch)
+
+            if row_count >= next_progress:
+                print(f"\rINSERTING ROWS OF FILE {source_name}... {row_count}", end="")
+                next_progress += PROGRESS_INTERVAL
+
+    print(f"\rINSERTING ROWS OF FILE {source_name}... {row_count} DONE")
+    return row_count
 
-    with open(csv_file, "r", encoding="utf-8") as in_stream:
-        reader = csv.DictReader(in_stream, delimiter=";")
 
-        column_headers = reader.fieldnames
-        column_headers_parsed = [parse_header(header) for header in column_headers]
+def read_csv_rows(in_stream: TextIO) -> Tuple[List[str], Iterator[Tuple]]:
+    reader = csv.reader(in_stream, delimiter=";")
 
-        for row_index, row in enumerate(reader):
-            print(f"INSERTING ROW {row_index + 1} OF FILE {basename(csv_file)}... ", end="")
-            cursor.execute(f"INSERT INTO {table_name} ({','.join(column_headers_parsed)}) VALUES ({','.join(['?' for _ in row])});",
-                           tuple(map(lambda x: str(x).strip(), row.values())))
-            print("DONE")
+    column_headers = next(reader)
+    column_count = len(column_headers)
 
+    # Missing values of short rows are stored as "None", as csv.DictReader would return them
+    rows = (tuple(map(str.strip, row[:column_count])) + ("None",) * (column_count - len(row))
+            for row in reader if len(row) > 0)
+
+    return column_headers, rows
+
+
+def read_worksheet_rows(worksheet) -> Tuple[List[str], Iterator[Tuple]]:
+    rows = worksheet.iter_rows(values_only=True)
+
+    column_headers = ["" if value is None else str(value) for value in next(rows, ())]
+    column_count = len(column_headers)
+
+    # Values are stored as they would be read from the file exported as csv, empty cells as ""
+    rows = (tuple("" if value is None else str(value).strip() for value in row[:column_count]) +
+            ("None",) * (column_count - len(row))
+            for row in rows if any(value is not None for value in row))
+
+    return column_headers, rows
+
+
+@contextmanager
+def open_data_file(filename: Union[PathLike, str]):
+    # EXCEL files are read directly, without converting them into csv first
+    if get_extension(filename) == "xlsx":
+        workbook, worksheet = load_worksheet(filename, 0, read_only=True)
+        try:
+            yield read_worksheet_rows(worksheet)
+        finally:
+            # Read-only workbooks keep the file open until closed
+            workbook.close()
+    else:
+        with open(filename, "r", encoding="utf-8", newline="") as in_stream:
+            yield read_csv_rows(in_stream)
+
+
+def get_table_columns(connection: sql.Connection, table_name: str) -> List[str]:
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table_name});")]
+
+
+def is_schema_current(connection: sql.Connection) -> bool:
+    if len(get_table_columns(connection, SETTINGS_TABLE_NAME)) == 0:
+        return False
+    schema = connection.execute(f"SELECT value FROM {SETTINGS_TABLE_NAME} WHERE name = 'schema';").fetchone()
+    return schema is not None and schema[0] == get_schema()
+
+
+def get_row_key(source_path: str, row: Tuple, key_indices: List[int], occurrences: Dict[bytes, int]) -> str:
+    # occurrences counts the keys of the file seen so far. Only repeated keys get a number, so inserting a row into the
+    # file does not change the keys of the rows after it
+    key = hashlib.sha1("\x1f".join([source_path] + [row[index] for index in key_indices]).encode("utf-8"))
+    occurrence = occurrences.get(key.digest(), 0)
+    occurrences[key.digest()] = occurrence + 1
+
+    return key.hexdigest() if occurrence == 0 else f"{key.hexdigest()}-{occurrence}"
+
+
+def prepare_incremental_table(connection: sql.Connection, column_names: List[str], table_name: str,
+                              source_name: str) -> None:
+    existing_columns = get_table_columns(connection, table_name)
+    if len(existing_columns) == 0:
+        create_table(connection, column_names, table_name, source_name)
+        existing_columns = get_table_columns(connection, table_name)
+
+    # Columns of data files that were added to the export later are added to the table
+    for column_name, column_type in SOURCE_COLUMNS + [(column_name, column_type) for (_, column_name, column_type)
+                                                      in get_stored_columns(column_names)]:
+        if column_name not in existing_columns:
+            connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type};")
+            existing_columns.append(column_name)
+
+    if not WITHOUT_ROWID:
+        connection.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_row_key ON {table_name} (row_key);")
+    connection.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_source ON {table_name} (source_file, import_id);")
     connection.commit()
 
+    add_normalized_columns(connection, table_name)
+
+
+def import_file(connection: sql.Connection, filename: Union[PathLike, str], table_name: str) -> None:
+    source_path = os.path.abspath(filename)
+    source_stat = os.stat(source_path)
+    source_hash = get_file_hash(source_path)
+
+    with open_data_file(filename) as (column_headers, rows):
+        column_names = [parse_header(header) for header in column_headers]
+        prepare_incremental_table(connection, column_names, table_name, basename(filename))
+        import_id = connection.execute(f"SELECT COALESCE(MAX(import_id), 0) + 1 FROM {table_name};").fetchone()[0]
+
+        key_indices = [column_names.index(column_name) for column_name in ROW_KEY_COLUMNS
+                       if column_name in column_names] or list(range(len(column_names)))
+        key_occurrences: Dict[bytes, int] = {}
+
+        stored_columns = get_stored_columns(column_names)
+        converters = [(column_index, get_type_converter(column_type))
+                      for (column_index, _, column_type) in stored_columns]
+
+        rows = ((source_path, get_row_key(source_path, row, key_indices, key_occurrences), import_id) +
+                tuple(row[column_index] if converter is None else converter(row[column_index])
+                      for (column_index, converter) in converters)
+                for row in rows)
+        row_count = insert_rows(connection, table_name,
+                                [column_name for (column_name, _) in SOURCE_COLUMNS] +
+                                [column_name for (_, column_name, _) in stored_columns],
+                                rows, basename(filename), upsert_key="row_key")
+
+    with bulk_load(connection):
+        # Rows that were not part of the file anymore
+        connection.execute(f"DELETE FROM {table_name} WHERE source_file = ? AND import_id != ?;",
+                           (source_path, import_id))
+        normalize_rows(connection, table_name, get_normalized_columns(), "source_file = ?", (source_path,))
+
+        connection.execute(f"INSERT OR REPLACE INTO {SOURCES_TABLE_NAME} (path, hash, mtime_ns, size, import_id, "
+                           f"row_count) VALUES (?, ?, ?, ?, ?, ?);",
+                           (source_path, source_hash, source_stat.st_mtime_ns, source_stat.st_size, import_id,
+                            row_count))
+
+
+def refresh_table(connection: sql.Connection, filenames: List[Union[PathLike, str]], table_name: str) -> int:
+    # Returns the number of files that were imported or removed
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {SOURCES_TABLE_NAME} (path TEXT PRIMARY KEY, hash TEXT, "
+                       f"mtime_ns INTEGER, size INTEGER, import_id INTEGER, row_count INTEGER);")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {SETTINGS_TABLE_NAME} (name TEXT PRIMARY KEY, value TEXT);")
+
+    # Tables created with other schema settings (or before they existed) are rebuilt
+    if len(get_table_columns(connection, table_name)) != 0 and not is_schema_current(connection):
+        print(f"SCHEMA SETTINGS OF TABLE {table_name} CHANGED, REBUILDING IT")
+        connection.execute(f"DROP TABLE {table_name};")
+        connection.execute(f"DELETE FROM {SOURCES_TABLE_NAME};")
+    connection.execute(f"INSERT OR REPLACE INTO {SETTINGS_TABLE_NAME} (name, value) VALUES ('schema', ?);",
+                       (get_schema(),))
+    connection.commit()
+
+    # Files that were not selected again are removed, as if the table was rebuilt from the selected files
+    changed_files = 0
+    source_paths = [os.path.abspath(filename) for filename in filenames]
+    for (source_path,) in connection.execute(f"SELECT path FROM {SOURCES_TABLE_NAME};").fetchall():
+        if source_path not in source_paths:
+            print(f"REMOVING ROWS OF FILE {basename(source_path)}")
+            connection.execute(f"DELETE FROM {table_name} WHERE source_file = ?;", (source_path,))
+            connection.execute(f"DELETE FROM {SOURCES_TABLE_NAME} WHERE path = ?;", (source_path,))
+            changed_files += 1
+    connection.commit()
+
+    for filename, source_path in zip(filenames, source_paths):
+        source_stat = os.stat(source_path)
+        source = connection.execute(f"SELECT hash, mtime_ns, size FROM {SOURCES_TABLE_NAME} WHERE path = ?;",
+                                    (source_path,)).fetchone()
+
+        if source is not None:
+            if source[1:] == (source_stat.st_mtime_ns, source_stat.st_size) or source[0] == get_file_hash(source_path):
+                print(f"FILE {basename(filename)} IS UNCHANGED")
+                connection.execute(f"UPDATE {SOURCES_TABLE_NAME} SET mtime_ns = ? WHERE path = ?;",
+                                   (source_stat.st_mtime_ns, source_path))
+                continue
+
+        import_file(connection, filename, table_name)
+        changed_files += 1
+
+    connection.commit()
+    return changed_files
+
 
 def get_extension(filename: Union[PathLike, str]) -> str:
     ext = filename.split(".")[-1]
@@ -112,51 +409,466 @@ def get_extension(filename: Union[PathLike, str]) -> str:
     return ext
 
 
-def update_extension(filename: Union[PathLike, str], new_extension: str) -> str:
+def append_to_filename(filename: Union[PathLike, str], appendix: str) -> str:
     filename_split = filename.split(".")
     filename_base = ".".join(filename_split[:-1])
 
     if len(filename_base) == "":
         # Original filename had no extension
-        return filename + "." + new_extension
+        return filename + appendix
 
-    return filename_base + "." + new_extension
+    return filename_base + appendix + "." + filename_split[-1]
 
 
-def append_to_filename(filename: Union[PathLike, str], appendix: str) -> str:
-    filename_split = filename.split(".")
-    filename_base = ".".join(filename_split[:-1])
+def normalize_text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
 
-    if len(filename_base) == "":
-        # Original filename had no extension
-        return filename + appendix
+    text = " ".join(str(value).lower().split())
+    if text in ["", "none"]:
+        return None
+    return text
 
-    return filename_base + appendix + "." + filename_split[-1]
 
+def normalize_cas(value: Any) -> Optional[str]:
+    text = normalize_text(value)
+    if text is None:
+        return None
+
+    # Leading zeros are not part of a CAS number, e.g. "0064-17-5" -> "64-17-5"
+    return text.replace(" ", "").lstrip("0")
 
-def SQLEqualTemplate(field_name: str, value: Any) -> str:
-    return f'{field_name} LIKE "{str(value).replace(",", ".").strip()}"'
 
+def parse_number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
 
-def SQLMaxDeviationTemplate(field_name: str, value: Any, max_deviation: float) -> str:
     try:
-        value = float(str(value).replace(",", ".").strip())
+        return float(str(value).replace(",", ".").replace("%", "").strip())
     except ValueError:
-        value = 200.0
-    return f'(CAST({field_name} AS DECIMAL) - {value}) < {max_deviation}'
+        return None
+
+
+COLUMN_NORMALIZERS = {
+    "cas_nr": normalize_cas,
+}
+
+
+def get_type_converter(column_type: str) -> Optional[Callable[[Any], Any]]:
+    if column_type in NUMERIC_COLUMN_TYPES:
+        return parse_number
+    return None
+
+
+def get_normalizer(column_name: str, max_offset: float) -> Callable[[Any], Any]:
+    if max_offset != 0 or COLUMN_TYPES.get(column_name) in NUMERIC_COLUMN_TYPES:
+        return parse_number
+    return COLUMN_NORMALIZERS.get(column_name, normalize_text)
+
+
+def normalized_column(column_name: str) -> str:
+    # Numeric columns are converted when imported already
+    if COLUMN_TYPES.get(column_name) in NUMERIC_COLUMN_TYPES:
+        return column_name
+    return column_name + NORMALIZED_COLUMN_SUFFIX
+
+
+def get_normalized_columns() -> List[Tuple[str, float]]:
+    # Equality columns first, so the range condition on the numeric columns can use the index as well
+    columns = [(DATA_PRODUCER_COLUMN, 0)] + [(column_name, max_offset)
+                                             for (column_name, _, max_offset) in CROSS_REFERENCES]
+    return sorted(columns, key=lambda column: column[1] != 0)
 
 
-def SQLDeviationTemplate(field_name: str, value: Any) -> str:
+def normalize_rows(connection: sql.Connection, table_name: str, columns: List[Tuple[str, float]],
+                   condition: str = "1", parameters: Tuple = ()) -> None:
+    columns = [(column_name, max_offset) for (column_name, max_offset) in columns
+               if normalized_column(column_name) != column_name]
+    if len(columns) == 0:
+        return
+
+    for column_name, max_offset in columns:
+        connection.create_function(f"normalize_{column_name}", 1, get_normalizer(column_name, max_offset),
+                                   deterministic=True)
+
+    connection.execute(f"UPDATE {table_name} SET " +
+                       ", ".join([f"{normalized_column(column_name)} = normalize_{column_name}({column_name})"
+                                  for (column_name, _) in columns]) +
+                       f" WHERE {condition};", parameters)
+
+
+def add_normalized_columns(connection: sql.Connection, table_name: str) -> None:
+    existing_columns = get_table_columns(connection, table_name)
+    missing_columns = [(column_name, max_offset) for (column_name, max_offset) in get_normalized_columns()
+                       if normalized_column(column_name) not in existing_columns]
+
+    if len(missing_columns) != 0:
+        print(f"NORMALIZING COLUMNS {', '.join([column_name for (column_name, _) in missing_columns])}... ", end="")
+
+        with bulk_load(connection):
+            for column_name, max_offset in missing_columns:
+                connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {normalized_column(column_name)} "
+                                   f"{'REAL' if max_offset != 0 else 'TEXT'};")
+
+            normalize_rows(connection, table_name, missing_columns)
+
+        print("DONE")
+
+    index_columns = [normalized_column(column_name) for (column_name, _) in get_normalized_columns()]
+    connection.execute(f"CREATE INDEX IF NOT EXISTS {CROSS_REFERENCE_INDEX} ON {table_name} "
+                       f"({', '.join(index_columns)});")
+    connection.commit()
+
+
+def get_trigrams(text: str) -> Set[str]:
+    # Padded, so the beginning of a name weighs more than its end and short names have trigrams as well
+    padded_text = f"  {text} "
+    return {padded_text[index:index + 3] for index in range(len(padded_text) - 2)}
+
+
+def build_trade_name_index(connection: sql.Connection, table_name: str) -> None:
+    print("INDEXING TRADE NAMES FOR FUZZY MATCHING... ", end="")
+
+    synonym_columns = [column_name for column_name in SYNONYM_COLUMNS
+                       if column_name in get_table_columns(connection, table_name)]
+
+    # Maps all trade names and synonyms to the trade names they stand for
+    names: Dict[str, Set[str]] = {}
+    name_columns = [normalized_column(TRADE_NAME_COLUMN)] + synonym_columns
+    for row in connection.execute(f"SELECT DISTINCT {', '.join(name_columns)} FROM {table_name};"):
+        trade_name = row[0]
+        if trade_name is None:
+            continue
+
+        names.setdefault(trade_name, set()).add(trade_name)
+        for synonyms in row[1:]:
+            for synonym in re.split(r"[,;]", synonyms or ""):
+                synonym = normalize_text(synonym)
+                if synonym is not None:
+                    names.setdefault(synonym, set()).add(trade_name)
+
+    name_rows = [(name, trade_name) for (name, trade_names) in names.items() for trade_name in sorted(trade_names)]
+
+    with bulk_load(connection):
+        connection.execute(f"DROP TABLE IF EXISTS {TRADE_NAMES_TABLE_NAME};")
+        connection.execute(f"DROP TABLE IF EXISTS {TRADE_NAME_TRIGRAMS_TABLE_NAME};")
+        connection.execute(f"DROP TABLE IF EXISTS {TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME};")
+        connection.execute(f"CREATE TABLE {TRADE_NAMES_TABLE_NAME} (id INTEGER PRIMARY KEY, name TEXT, "
+                           f"trade_name TEXT);")
+        # The trigram count of the name is part of the key, so names of unsuitable length are skipped in the index
+        connection.execute(f"CREATE TABLE {TRADE_NAME_TRIGRAMS_TABLE_NAME} (trigram TEXT, trigram_count INTEGER, "
+                           f"name_id INTEGER, PRIMARY KEY (trigram, trigram_count, name_id)) WITHOUT ROWID;")
+
+        connection.executemany(f"INSERT INTO {TRADE_NAMES_TABLE_NAME} (id, name, trade_name) VALUES (?, ?, ?);",
+                               [(name_id,) + name_row for (name_id, name_row) in enumerate(name_rows, 1)])
+        connection.executemany(f"INSERT INTO {TRADE_NAME_TRIGRAMS_TABLE_NAME} (trigram, trigram_count, name_id) "
+                               f"VALUES (?, ?, ?);",
+                               ((trigram, len(trigrams), name_id) for (name_id, (name, _)) in enumerate(name_rows, 1)
+                                for trigrams in [get_trigrams(name)] for trigram in trigrams))
+
+        connection.execute(f"CREATE TABLE {TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME} AS SELECT trigram, "
+                           f"COUNT(*) AS name_count FROM {TRADE_NAME_TRIGRAMS_TABLE_NAME} GROUP BY trigram;")
+        connection.execute(f"CREATE UNIQUE INDEX {TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME}_trigram "
+                           f"ON {TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME} (trigram, name_count);")
+
+    print(f"{len(names)} NAMES DONE")
+
+
+def get_similarity(trigrams: Set[str], other_trigrams: Set[str]) -> float:
+    return 2.0 * len(trigrams & other_trigrams) / (len(trigrams) + len(other_trigrams))
+
+
+def find_similar_trade_name(connection: sql.Connection, name: str, threshold: float) -> Optional[Tuple[str, float]]:
+    trigrams = get_trigrams(name)
+    placeholders = ", ".join(["?" for _ in trigrams])
+    name_counts = dict(connection.execute(f"SELECT trigram, name_count FROM {TRADE_NAME_TRIGRAM_COUNTS_TABLE_NAME} "
+                                          f"WHERE trigram IN ({placeholders});", list(trigrams)))
+
+    # A name with a similarity of at least threshold has a similar number of trigrams and shares at least min_overlap
+    # of them with name, all of them indexed. So it shares at least min_rare_overlap of the rarest indexed trigrams,
+    # only names that do are compared (prefix filtering)
+    min_trigram_count = threshold * len(trigrams) / (2 - threshold)
+    max_trigram_count = (2 - threshold) * len(trigrams) / threshold
+    min_overlap = ceil(min_trigram_count)
+    rare_trigrams = sorted(name_counts, key=name_counts.get)[:len(name_counts) - min_overlap + 3]
+    min_rare_overlap = min_overlap - (len(name_counts) - len(rare_trigrams))
+    if len(rare_trigrams) == 0 or min_rare_overlap > len(rare_trigrams):
+        return None
+
+    name_ids = [row[0] for row in connection.execute(
+        f"SELECT name_id FROM {TRADE_NAME_TRIGRAMS_TABLE_NAME} "
+        f"WHERE trigram IN ({', '.join(['?' for _ in rare_trigrams])}) AND trigram_count BETWEEN ? AND ? "
+        f"GROUP BY name_id HAVING COUNT(*) >= ?;",
+        rare_trigrams + [min_trigram_count, max_trigram_count, min_rare_overlap])]
+
+    best_match = None
+    for name_id, candidate_name, trade_name in connection.execute(
+            f"SELECT id, name, trade_name FROM {TRADE_NAMES_TABLE_NAME} "
+            f"WHERE id IN ({', '.join(['?' for _ in name_ids])}) ORDER BY id;", name_ids):
+        similarity = get_similarity(trigrams, get_trigrams(candidate_name))
+        if similarity >= threshold and (best_match is None or similarity > best_match[1]):
+            best_match = (trade_name, similarity)
+
+    return best_match
+
+
+def resolve_trade_names(connection: sql.Connection, table_name: str, candidates: List[Tuple[int, dict]]) -> int:
+    # Replaces unknown trade names of the candidates (see match_rows) by similar ones, returns the number replaced
+    known_names = {row[0] for row in connection.execute(
+        f"SELECT DISTINCT {normalized_column(TRADE_NAME_COLUMN)} FROM {table_name};")}
+    resolved_names: Dict[str, Optional[str]] = {}
+
+    num_resolved = 0
+    for _, values in candidates:
+        name = normalize_text(values[TRADE_NAME_COLUMN])
+        if name is None or name in known_names:
+            continue
+
+        if name not in resolved_names:
+            similar_name = find_similar_trade_name(connection, name, FUZZY_MATCHING_THRESHOLD)
+            resolved_names[name] = None if similar_name is None else similar_name[0]
+
+        if resolved_names[name] is not None:
+            values[TRADE_NAME_COLUMN] = resolved_names[name]
+            num_resolved += 1
+
+    return num_resolved
+
+
+def cross_reference_query(table_name: str, result_columns: str, best_match: bool = False) -> str:
+    # Numbered parameters, so the numeric parameters can be used for the deviation as well
+    conditions = []
+    deviations = []
+    for parameter_index, (column_name, max_offset) in enumerate(get_normalized_columns(), 1):
+        if max_offset == 0:
+            conditions.append(f"{normalized_column(column_name)} = ?{parameter_index}")
+        else:
+            conditions.append(f"(?{parameter_index} IS NULL OR "
+                              f"ABS({normalized_column(column_name)} - ?{parameter_index}) < {float(max_offset)})")
+            deviations.append(f"COALESCE(ABS({normalized_column(column_name)} - ?{parameter_index}), 0)")
+
+    query = f"SELECT {result_columns} FROM {table_name} WHERE {' AND '.join(conditions)}"
+    if best_match:
+        query += f" ORDER BY {' + '.join(deviations + ['0'])}, {get_row_id_column()} LIMIT 1"
+
+    return query + ";"
+
+
+def cross_reference_parameters(values: dict) -> Tuple:
+    # values maps the queried column names (except DATA_PRODUCER_COLUMN) to the values of a data collection row
+    values = dict(values, **{DATA_PRODUCER_COLUMN: DATA_PRODUCER_ALL})
+
+    return tuple(get_normalizer(column_name, max_offset)(values[column_name])
+                 for (column_name, max_offset) in get_normalized_columns())
+
+
+def cross_reference_join(table_name: str, candidates_table_name: str, result_columns: str,
+                         best_match: bool = False) -> str:
+    conditions = []
+    deviations = []
+    for column_name, max_offset in get_normalized_columns():
+        data_column = f"{table_name}.{normalized_column(column_name)}"
+        candidate_column = f"{candidates_table_name}.{normalized_column(column_name)}"
+
+        if max_offset == 0:
+            conditions.append(f"{data_column} = {candidate_column}")
+        else:
+            conditions.append(f"({candidate_column} IS NULL OR ABS({data_column} - {candidate_column}) < "
+                              f"{float(max_offset)})")
+            deviations.append(f"COALESCE(ABS({data_column} - {candidate_column}), 0)")
+
+    join = f"FROM {candidates_table_name} JOIN {table_name} ON {' AND '.join(conditions)}"
+    if not best_match:
+        return f"SELECT {result_columns} {join}"
+
+    # Rank the matches of each candidate by their deviation, the first match of the data table wins ties
+    return (f"SELECT {result_columns} FROM ("
+            f"SELECT {candidates_table_name}.row_nr AS row_nr, {table_name}.*, ROW_NUMBER() OVER ("
+            f"PARTITION BY {candidates_table_name}.row_nr ORDER BY {' + '.join(deviations + ['0'])}, "
+            f"{table_name}.{get_row_id_column()}"
+            f") AS match_rank {join}) WHERE match_rank = 1")
+
+
+def get_statement_columns(connection: sql.Connection, table_name: str) -> List[str]:
+    existing_columns = get_table_columns(connection, table_name)
+    statement_columns = [column_name for (column_name, _) in STATEMENT_COLUMNS if column_name in existing_columns]
+
+    missing_columns = [column_name for (column_name, _) in STATEMENT_COLUMNS if column_name not in existing_columns]
+    if len(missing_columns) != 0:
+        print(f"STATEMENT COLUMNS {', '.join(missing_columns)} NOT FOUND IN TABLE {table_name}, NOT COPYING THEM")
+
+    return statement_columns
+
+
+def match_rows(connection: sql.Connection, table_name: str, candidates: List[Tuple[int, dict]]) \
+        -> Dict[int, Dict[str, Any]]:
+    # candidates are the row numbers and values of the data collection rows to match, as for cross_reference_parameters.
+    # Returns the statement columns of the best match of each matched row
+    cursor: sql.Cursor = connection.cursor()
+    statement_columns = get_statement_columns(connection, table_name)
+    cross_reference_request = cross_reference_query(table_name, ", ".join([get_row_id_column()] + statement_columns),
+                                                    best_match=True)
+
+    matches = {}
+    for row_number, values in candidates:
+        cursor.execute(cross_reference_request, cross_reference_parameters(values))
+        best_match = cursor.fetchone()
+        if best_match is not None:
+            matches[row_number] = dict(zip(statement_columns, best_match[1:]))
+
+    return matches
+
+
+def match_rows_batch(connection: sql.Connection, table_name: str, candidates: List[Tuple[int, dict]]) \
+        -> Dict[int, Dict[str, Any]]:
+    column_names = [normalized_column(column_name) for (column_name, _) in get_normalized_columns()]
+    statement_columns = get_statement_columns(connection, table_name)
+
+    connection.execute(f"DROP TABLE IF EXISTS temp.{CANDIDATES_TABLE_NAME};")
+    connection.execute(f"CREATE TEMPORARY TABLE {CANDIDATES_TABLE_NAME} (row_nr INTEGER PRIMARY KEY, "
+                       f"{', '.join(column_names)});")
+    connection.executemany(f"INSERT INTO {CANDIDATES_TABLE_NAME} (row_nr, {', '.join(column_names)}) "
+                           f"VALUES ({', '.join(['?' for _ in range(len(column_names) + 1)])});",
+                           [(row_number,) + cross_reference_parameters(values) for (row_number, values) in candidates])
+
+    matches = {row[0]: dict(zip(statement_columns, row[1:])) for row in connection.execute(
+        cross_reference_join(table_name, CANDIDATES_TABLE_NAME, ", ".join(["row_nr"] + statement_columns),
+                             best_match=True) + " ORDER BY row_nr;")}
+
+    connection.execute(f"DROP TABLE temp.{CANDIDATES_TABLE_NAME};")
+    connection.commit()
+    return matches
+
+
+def is_empty(value: Any) -> bool:
+    return str(value).strip() in ["", "None"]
+
+
+def process_datacollection_file(connection: sql.Connection, filename: Union[PathLike, str]) \
+        -> Tuple[int, int, int, Optional[str]]:
+    # Returns the number of rows without product id, matches and rows statements were copied into and the output file
+    cross_references = [(column_name, column_index_from_string(xlsx_column)-1, max_offset) for
+                        (column_name, xlsx_column, max_offset) in CROSS_REFERENCES]
+    datacollection_product_id_column = column_index_from_string(DATACOLLECTION_PRODUCT_ID_COLUMN) - 1
+    datacollection_marker_column = column_index_from_string(DATACOLLECTION_MARKER_COLUMN)
+    statement_columns = [(db_column, column_index_from_string(xlsx_column)) for
+                         (db_column, xlsx_column) in STATEMENT_COLUMNS]
+
+    print(f"PROCESSING FILE {basename(filename)}... ")
+    workbook, worksheet = load_worksheet(filename, DATACOLLECTION_SHEET_NAME)
+
+    worksheet_line_count = get_last_row(worksheet)
+
+    # Rows without product id are matched against the data table
+    candidates = []
+    rows_without_statements = set()
+    for row_index, row in enumerate(worksheet.iter_rows(min_row=3, max_row=worksheet_line_count)):
+        if all(map(lambda x: is_empty(x.value), row)):
+            print(f"EMPTY ROW {row_index + 3}, IGNORING FOLLOWING ROWS")
+            break
+
+        if is_empty(row[datacollection_product_id_column].value):
+            candidates.append((row_index + 3, {db_column: row[xlsx_column].value
+                                               for (db_column, xlsx_column, _) in cross_references}))
+
+            if len(statement_columns) != 0 and is_empty(row[statement_columns[0][1] - 1].value):
+                rows_without_statements.add(row_index + 3)
+
+    if FUZZY_MATCHING:
+        num_resolved = resolve_trade_names(connection, TABLE_NAME, candidates)
+        print(f"FOUND SIMILAR TRADE NAMES FOR {num_resolved} ROWS")
+
+    print(f"MATCHING {len(candidates)} ROWS WITHOUT PRODUCT ID... ", end="")
+    if BATCH_MATCHING:
+        matches = match_rows_batch(connection, TABLE_NAME, candidates)
+    else:
+        matches = match_rows(connection, TABLE_NAME, candidates)
+    print("DONE")
+
+    # Mark all matches and copy the statements of the best match into rows without H-Statements in one pass
+    num_matches = len(matches)
+    num_copied = 0
+    for row_number, statements in matches.items():
+        worksheet.cell(row=row_number, column=datacollection_marker_column).value = "x"
+
+        if row_number in rows_without_statements:
+            for db_column, xlsx_column in statement_columns:
+                if db_column in statements:
+                    value = statements[db_column]
+                    worksheet.cell(row=row_number, column=xlsx_column).value = None if is_empty(value) else value
+            num_copied += 1
+
+    print(f"FINISHED PROCESSING FILE {basename(filename)}")
+    print(f"COPIED STATEMENTS INTO {num_copied} ROWS WITHOUT H-STATEMENTS")
+    out_filename = None
+    if num_matches != 0:
+        out_filename = append_to_filename(filename, "_x")
+
+        num_appendix = 2
+        while os.path.exists(out_filename):
+            out_filename = append_to_filename(filename, "_x" + str(num_appendix))
+            num_appendix += 1
+
+        workbook.save(out_filename)
+
+        print(f"FOUND {num_matches} MATCHES")
+        print(f"WROTE CHANGES TO {out_filename}")
+
+    return len(candidates), num_matches, num_copied, out_filename
+
+
+def try_process_datacollection_file(connection: sql.Connection, filename: Union[PathLike, str]) \
+        -> Tuple[Any, Optional[str]]:
+    # A file that can not be processed is reported with its error, without stopping the other files
     try:
-        value = float(str(value).replace(",", ".").strip())
-    except ValueError:
-        value = 200.0
-    return f'(CAST({field_name} AS DECIMAL) - {value})'
+        return process_datacollection_file(connection, filename), None
+    except Exception as exception:
+        error = repr(exception)
+        print(f"ERROR PROCESSING FILE {basename(filename)}: {error}")
+        return None, error
+
+
+def process_datacollection_file_worker(filename: Union[PathLike, str]) -> Tuple[str, Any, Optional[str], str]:
+    # Every worker reads the database through its own read-only connection, the output is printed by the main process
+    # once the file is finished, so the progress of files processed at the same time is not interleaved
+    output = io.StringIO()
+    with redirect_stdout(output):
+        connection = sql.connect(Path(DATABASE_FILE).resolve().as_uri() + "?mode=ro", uri=True)
+        try:
+            result, error = try_process_datacollection_file(connection, filename)
+        finally:
+            connection.close()
+
+    return filename, result, error, output.getvalue()
+
+
+def process_datacollection_files(connection: sql.Connection, filenames: List[Union[PathLike, str]]) -> None:
+    results = []
+    if not PARALLEL_PROCESSING or len(filenames) <= 1:
+        for filename in filenames:
+            results.append((filename,) + try_process_datacollection_file(connection, filename))
+    else:
+        # The workers only see committed changes of the data table
+        connection.commit()
+
+        with Pool(min(MAX_WORKERS, len(filenames))) as pool:
+            for filename, result, error, output in pool.imap_unordered(process_datacollection_file_worker,
+                                                                       filenames):
+                print(output, end="")
+                results.append((filename, result, error))
+
+    print(f"PROCESSED {len(filenames)} DATA COLLECTION FILE(S)")
+    for filename, result, error in sorted(results, key=lambda item: str(item[0])):
+        if error is not None:
+            print(f"{basename(filename)}: FAILED ({error})")
+        else:
+            num_candidates, num_matches, num_copied, out_filename = result
+            print(f"{basename(filename)}: {num_matches} OF {num_candidates} ROWS MATCHED, STATEMENTS COPIED INTO "
+                  f"{num_copied} ROWS" + ("" if out_filename is None else f", WROTE {basename(out_filename)}"))
 
 
 def main():
-    connection: sql.Connection = sql.connect("db.sqlite")
-    cursor: sql.Cursor = connection.cursor()
+    connection: sql.Connection = sql.connect(DATABASE_FILE)
 
     window = Tk()
     filenames = askopenfilenames(title="Select data file(s)",
@@ -165,35 +877,22 @@ def main():
                                             ("EXCEL Files", "*.xlsx")])
     window.destroy()
 
+    changed_files = 0
     if len(filenames) == 0:
         # Assume the database is already setup/populated
         print("No files provided. Assuming the database is already populated")
-    else:
-        # Reset table and create with new files as template
-        try:
-            connection.execute(f"DROP TABLE {TABLE_NAME};")
-            connection.commit()
-        except sql.OperationalError:
-            # Table does not exist, so it does not have to be deleted
-            pass
-
-        # Convert EXCEL files into csv if not already csv
-        filenames_tmp = []
-        for filename in filenames:
-            if get_extension(filename) == "xlsx":
-                _, worksheet = load_worksheet(filename, 0)
-
-                # Update filename to ".csv" extension and convert
-                filename = update_extension(filename, "csv")
-                excel_to_csv(worksheet, filename)
-            filenames_tmp.append(filename)
-        filenames = filenames_tmp
 
-        create_table_from_csv(connection, filenames[0], TABLE_NAME)
+        if not is_schema_current(connection):
+            print("The schema settings changed since the database was populated. Select the data files again to "
+                  "rebuild it.")
+    else:
+        # Update the table with the selected files, only files that changed since their last import are read
+        changed_files = refresh_table(connection, filenames, TABLE_NAME)
 
-        for filename in filenames:
-            populate_table(connection, filename, TABLE_NAME)
+    add_normalized_columns(connection, TABLE_NAME)
 
+    if FUZZY_MATCHING and (changed_files != 0 or len(get_table_columns(connection, TRADE_NAMES_TABLE_NAME)) == 0):
+        build_trade_name_index(connection, TABLE_NAME)
 
     # Read data collection ('Datenerfassung') sheets
     window = Tk()
@@ -201,65 +900,7 @@ def main():
                                  filetypes=[("EXCEL Files", "*.xlsx"), ])
     window.destroy()
 
-    cross_references = [(column_name, column_index_from_string(xlsx_column)-1, max_offset) for
-                        (column_name, xlsx_column, max_offset) in CROSS_REFERENCES]
-    datacollection_product_id_column = column_index_from_string(DATACOLLECTION_PRODUCT_ID_COLUMN) - 1
-    datacollection_marker_column = column_index_from_string(DATACOLLECTION_MARKER_COLUMN) - 1
-
-    for filename in filenames:
-        print(f"PROCESSING FILE {basename(filename)}... ")
-        workbook, worksheet = load_worksheet(filename, DATACOLLECTION_SHEET_NAME)
-        num_matches = 0
-
-        worksheet_line_count = get_worksheet_line_count(worksheet) + 1
-
-        for row_index, row in enumerate(worksheet.iter_rows(min_row=3, max_row=worksheet_line_count)):
-            print(f"PROCESSING ROW {row_index + 3} OF {worksheet_line_count}... ", end="")
-
-            if all(map(lambda x: str(x.value).strip() in ["", "None"], row)):
-                print("EMPTY ROW")
-                break
-
-            if str(row[datacollection_product_id_column].value).strip() in ["", "None"]:
-                cross_reference_request = ' AND '.join([SQLEqualTemplate(db_column, row[xlsx_column].value) if max_offset == 0 else
-                                                        SQLMaxDeviationTemplate(db_column, row[xlsx_column].value, max_offset)
-                                                        for (db_column, xlsx_column, max_offset) in cross_references])
-                deviation_queries = [SQLDeviationTemplate(db_column, row[xlsx_column].value + " ASC")
-                                     if max_offset != 0 else None
-                                     for (db_column, xlsx_column, max_offset) in cross_references]
-                deviation_queries = list(filter(lambda x: x is not None, deviation_queries))
-                cursor.execute(f"SELECT COUNT(id) FROM {TABLE_NAME} "
-                               f"WHERE {DATA_PRODUCER_COLUMN} LIKE '{DATA_PRODUCER_ALL}' AND "
-                               f"{cross_reference_request}"
-                               f" ORDER BY {','.join(deviation_queries)}")
-                res = cursor.fetchone()
-                if res[0] != 0:
-                    num_matches += 1
-                    worksheet.cell(row=row_index+3, column=datacollection_marker_column).value = "x"
-
-                    # TODO
-                    # Check if there are H-Rules in Datenerfassung?
-                    # Yes: Ignore
-                    # No:
-                    #   Copy over H-, P- and EUH-Rules from rollout with lowest deviation
-
-                    print("MATCH FOUND")
-                    continue
-            print("NO MATCH")
-
-        print(f"FINISHED PROCESSING FILE {basename(filename)}")
-        if num_matches != 0:
-            out_filename = append_to_filename(filename, "_x")
-
-            num_appendix = 2
-            while os.path.exists(out_filename):
-                out_filename = append_to_filename(filename, "_x" + str(num_appendix))
-                num_appendix += 1
-
-            workbook.save(out_filename)
-
-            print(f"FOUND {num_matches} MATCHES")
-            print(f"WROTE CHANGES TO {out_filename}")
+    process_datacollection_files(connection, filenames)
 
     connection.commit()
     connection.close()
@@ -21,6 +21,7 @@ The input format of the EXCEL-sheet is the following:
 from tkinter.filedialog import askopenfilename
 from tkinter import Tk
 from openpyxl import load_workbook
+from excel_utils import get_last_row
 import io
 import time
 import datetime
@@ -61,12 +62,7 @@ print("\n" + "geprüfte Datei:" + "\n" + data + "\n")
 
 # Finde Index von letzter nicht-leeren Zeile
 max_col = ws.max_column
-for row_nr, row in enumerate(ws.iter_rows()):
-    if any([cell.value is not None for cell in row]):
-        max_row = row_nr
-        # print(row_nr, [(col_nr, cell.value, type(cell.value)) for col_nr, cell in enumerate(row) if cell.value is not None])
-    else:
-        pass
+max_row = get_last_row(ws) - 1
         
     
 # Header
@@ -39,15 +39,32 @@ from pdfminer.pdfdocument import PDFTextExtractionNotAllowed
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import TextConverter
 from pdfminer.pdfpage import PDFPage
-from pdfminer.layout import LAParams
-from multiprocessing import Pool
-from typing import List, Tuple
+from pdfminer.layout import LAParams, LTPage
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from multiprocessing import Pool, SimpleQueue, active_children, cpu_count
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Sized, TextIO, Tuple
+from itertools import chain, islice
+from contextlib import contextmanager
 from io import StringIO
-from time import time
+from time import time, perf_counter
 from glob import glob
+import sqlite3 as sql
+import argparse
+import signal
+import queue
+import hashlib
+import json
+import csv
 import sys
+import os
 import re
 
+try:
+    # Only available on Unix, the memory limit of worker processes is not applied elsewhere
+    import resource
+except ImportError:
+    resource = None
+
 out_file = None
 
 
@@ -62,6 +79,265 @@ def timeit(func):
     return inner_timeit
 
 
+class ReadTimeout(BaseException):
+    """
+    Raised when reading a pdf file takes longer than the timeout. Derived from BaseException, so it is not caught by
+    the exception handling within pdfminer.
+    """
+
+
+def raise_read_timeout(signal_number, frame):
+    raise ReadTimeout()
+
+
+class Metrics:
+    """
+    Collection of timings and throughput of a batch. Stages are timed with measure (in the main process) or added
+    from the per-document statistics of read_pdf (in the worker processes). As documents are read in parallel, the
+    stage totals are summed over all workers and may exceed the wall time of the batch.
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.stages: Dict[str, List[float]] = {}  # stage -> [total seconds, number of calls]
+        self.documents: Dict[str, Dict[str, float]] = {}
+
+    def add(self, stage: str, seconds: float, filename: Optional[str] = None) -> None:
+        """
+        Add the duration of a stage, optionally to the statistics of a document as well
+
+        :param stage: name of the stage
+        :param seconds: duration of the stage
+        :param filename: document the stage belongs to
+        """
+        total = self.stages.setdefault(stage, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+        if filename is not None:
+            document = self.documents.setdefault(filename, {})
+            document[stage] = document.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage: str, filename: Optional[str] = None):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start, filename)
+
+    def add_document(self, filename: str, stats: Dict[str, float]) -> None:
+        """
+        Add the statistics of a document as returned by read_pdf: its stage durations, pages and bytes
+
+        :param filename: path of the document
+        :param stats: Dictionary of stage durations and the counters "pages" and "bytes"
+        """
+        document = self.documents.setdefault(filename, {})
+
+        for key, value in stats.items():
+            if key in ("pages", "bytes", "cached", "status", "error"):
+                document[key] = value
+            else:
+                self.add(key, value, filename)
+
+    def summary(self) -> Dict:
+        """
+        :return: Dictionary containing the totals of the batch, each stage and each document
+        """
+        wall_time = perf_counter() - self.start
+        pages = sum(document.get("pages", 0) for document in self.documents.values())
+        size = sum(document.get("bytes", 0) for document in self.documents.values())
+
+        return {
+            "wall_time": wall_time,
+            "documents": len(self.documents),
+            "cached_documents": sum(1 for document in self.documents.values() if document.get("cached", False)),
+            "pages": pages,
+            "bytes": size,
+            "documents_per_second": len(self.documents) / wall_time if wall_time > 0 else 0.0,
+            "pages_per_second": pages / wall_time if wall_time > 0 else 0.0,
+            "megabytes_per_second": size / 1024 / 1024 / wall_time if wall_time > 0 else 0.0,
+            "stages": {stage: {"total": total, "calls": calls, "mean": total / calls}
+                       for stage, (total, calls) in self.stages.items()},
+            "per_document": self.documents
+        }
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+
+        print(f"\n{summary['documents']} documents ({summary['cached_documents']} from cache), {summary['pages']} "
+              f"pages, {summary['bytes'] / 1024 / 1024:.1f} MB in {summary['wall_time']:.2f}s: "
+              f"{summary['documents_per_second']:.1f} documents/s, {summary['pages_per_second']:.1f} pages/s, "
+              f"{summary['megabytes_per_second']:.2f} MB/s")
+
+        stage_total = sum(stage["total"] for stage in summary["stages"].values()) or 1.0
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+            print(f"\t{name + ':':10}{stage['total']:9.3f}s total {stage['mean'] * 1000:9.2f}ms mean "
+                  f"{stage['calls']:8d} calls {stage['total'] / stage_total:7.1%}")
+
+    def write_json(self, filename: str) -> None:
+        with open(filename, "w", encoding="utf-8") as out_stream:
+            json.dump(self.summary(), out_stream, indent=2)
+
+
+class FastTextConverter(TextConverter):
+    """
+    TextConverter that skips the layout analysis of pdfminer. Instead of collecting the characters of a page for
+    layout analysis, each character is written as soon as it is rendered, with a line break whenever the baseline
+    changes and a whitespace whenever there is a gap to the previous character on the same line. This keeps the
+    lines of the text intact, but not the reading order of columns or text boxes, which is not needed for finding
+    the statements.
+    """
+    WORD_MARGIN = 0.1
+
+    # End of the baseline and font size of the previously written character on the current page
+    previous_char: Optional[Tuple[float, float, float]] = None
+
+    def render_char(self, matrix, font, fontsize, scaling, rise, cid, ncs, graphicstate) -> float:
+        try:
+            text = font.to_unichr(cid)
+        except PDFUnicodeNotDefined:
+            text = self.handle_undefined_char(font, cid)
+
+        advance = font.char_width(cid) * fontsize * scaling
+        (a, b, c, d, x, y) = matrix
+        size = fontsize * (abs(d) or abs(b) or 1)
+
+        if self.previous_char is not None:
+            previous_x, previous_y, previous_size = self.previous_char
+
+            if abs(y - previous_y) > min(size, previous_size) / 2:
+                self.write_text("\n")
+            elif x - previous_x > self.WORD_MARGIN * size:
+                self.write_text(" ")
+
+        self.write_text(text)
+        self.previous_char = (x + advance * a, y, size)
+
+        return advance
+
+    def receive_layout(self, ltpage: LTPage) -> None:
+        self.previous_char = None
+        self.write_text("\f")
+
+
+class ExtractCache:
+    """
+    On-disk cache of the text read from pdf files and the statements found in it, keyed by the hash of the file
+    content. The text is stored with a version stamp of the settings used for reading the file, the statements with
+    a version stamp of the patterns used for finding them, so outdated entries are not returned. If the texts stored
+    exceed max_bytes in total, the least recently used entries are removed.
+    """
+
+    def __init__(self, filename: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.connection: sql.Connection = sql.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (file_hash TEXT PRIMARY KEY, "
+                                "text_version TEXT, text TEXT, result_version TEXT, result TEXT, "
+                                "size INTEGER, last_used REAL);")
+        self.connection.commit()
+
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache;").fetchone()[0]
+        if self.size > self.max_bytes:
+            self.evict()
+            self.connection.commit()
+
+    @staticmethod
+    def file_hash(filename: str) -> str:
+        """
+        Calculate the hash of the content of a file
+
+        :param filename: relative or absolute path of the file
+        :return: SHA-256 hash of the file content as hex string
+        """
+        file_hash = hashlib.sha256()
+
+        with open(filename, "rb") as in_stream:
+            for block in iter(lambda: in_stream.read(1 << 20), b""):
+                file_hash.update(block)
+
+        return file_hash.hexdigest()
+
+    def contains(self, file_hash: str, text_version: str) -> bool:
+        """
+        Check whether the text of a file is stored
+
+        :param file_hash: hash of the file content as returned by file_hash
+        :param text_version: version stamp of the settings used for reading the file
+        :return: whether or not the text is stored for the given version
+        """
+        return self.connection.execute("SELECT 1 FROM cache WHERE file_hash = ? AND text_version = ?;",
+                                       (file_hash, text_version)).fetchone() is not None
+
+    def get(self, file_hash: str, text_version: str, result_version: str) \
+            -> Tuple[Optional[str], Optional[Tuple[List[str], List[str], List[str], List[str], str]]]:
+        """
+        Look up the text and statements stored for a file
+
+        :param file_hash: hash of the file content as returned by file_hash
+        :param text_version: version stamp of the settings used for reading the file
+        :param result_version: version stamp of the patterns used for finding the statements
+        :return: Tuple of the stored text and statements as returned by GMSExtract.process, each None if not stored
+        for the given version
+        """
+        row = self.connection.execute("SELECT text_version, text, result_version, result FROM cache "
+                                      "WHERE file_hash = ?;", (file_hash,)).fetchone()
+
+        if row is None or row[0] != text_version:
+            return None, None
+
+        self.connection.execute("UPDATE cache SET last_used = ? WHERE file_hash = ?;", (time(), file_hash))
+
+        if row[2] != result_version:
+            return row[1], None
+
+        return row[1], tuple(json.loads(row[3]))
+
+    def put(self, file_hash: str, text_version: str, text: str, result_version: str,
+            result: Tuple[List[str], List[str], List[str], List[str], str]) -> None:
+        """
+        Store the text and statements of a file, replacing the previous entry and evicting the least recently used
+        entries if the cache grows too large
+
+        :param file_hash: hash of the file content as returned by file_hash
+        :param text_version: version stamp of the settings used for reading the file
+        :param text: text read from the file
+        :param result_version: version stamp of the patterns used for finding the statements
+        :param result: statements as returned by GMSExtract.process
+        """
+        previous = self.connection.execute("SELECT size FROM cache WHERE file_hash = ?;", (file_hash,)).fetchone()
+        if previous is not None:
+            self.size -= previous[0]
+
+        size = len(text.encode("utf-8"))
+        self.connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?);",
+                                (file_hash, text_version, text, result_version, json.dumps(result), size, time()))
+        self.size += size
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+        self.connection.commit()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the stored texts fit into max_bytes
+        """
+        rows = self.connection.execute("SELECT file_hash, size FROM cache ORDER BY last_used ASC;").fetchall()
+
+        for file_hash, size in rows:
+            if self.size <= self.max_bytes:
+                break
+
+            self.connection.execute("DELETE FROM cache WHERE file_hash = ?;", (file_hash,))
+            self.size -= size
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+
 class GMSExtract:
     h_pattern = re.compile(r"(?:(?<!EU)H[2-4][0-9]{2}[dDfF]{0,2}(?![0-9]))"
                            r"(?:\s*\+\s*(?<!EU)H[2-4][0-9]{2}[dDfF]{0,2}(?![0-9]))*")
@@ -71,53 +347,476 @@ class GMSExtract:
     WGK_pattern = re.compile(r"[Ww]assergefährdungsklasse.*?[0-3](?![0-9])")
     cas_pattern = re.compile(r"[0-9]{1,8}-[0-9]{2}-[0-9](?![0-9])")
 
+    # Combination of all patterns above, applied to the raw (not normalized) input in a single pass. Each alternative
+    # is wrapped in a lookahead, so hits of different kinds may overlap just as with separate findall calls.
+    scan_pattern = re.compile(rf"(?=[HPEWw0-9])(?=(?P<h>{h_pattern.pattern})|(?P<p>{p_pattern.pattern})|"
+                              rf"(?P<euh>{euh_pattern.pattern})|(?P<cas>{cas_pattern.pattern})|"
+                              r"WGK.*?(?P<wgk>[0-3])(?![0-9])|"
+                              r"[Ww]assergefährdungsklasse.*?(?P<WGK>[0-3])(?![0-9]))", re.DOTALL)
+    plus_pattern = re.compile(r"\s*\+\s*")
+    section_pattern = re.compile(r"(?:ABSCHNITT|Abschnitt|SECTION|Section)\s*([0-9]{1,2})(?![0-9])")
+
     OUTPUT_SEP = "\t"
 
+    # Maximum number of pages read per pdf file
+    MAX_PAGES = 12
+    # Stop reading a pdf file once section 2 and the WGK have been read, see is_extraction_complete
+    EARLY_EXIT = False
+    # Text extraction engine: "layout" uses the layout analysis of pdfminer, "fast" skips it (see FastTextConverter)
+    ENGINES = ("layout", "fast")
+    ENGINE = "layout"
+
     USE_MULTIPROCESSING = True
+    MAX_WORKERS = cpu_count()
+    CHUNKS_PER_WORKER = 4
+    # Files are dispatched in chunks of at most MAX_CHUNK_SIZE files, and at most MAX_WORKERS * CHUNKS_PER_WORKER chunks
+    # ahead of the first unfinished file, which bounds the contents held back by read_pdf_stream
+    MAX_CHUNK_SIZE = 8
+    # Worker processes are replaced after this many chunks of files to release memory leaked by broken files
+    MAX_TASKS_PER_CHILD = 50
+    # Reading a pdf file is aborted after FILE_TIMEOUT seconds (None for no limit). On Unix, the worker aborts the file
+    # itself, elsewhere (and on Unix if that does not work) the worker process is terminated after twice as long
+    FILE_TIMEOUT: Optional[float] = 120
+    # Address space limit of each worker process in megabytes (Unix only, None for no limit)
+    MEMORY_LIMIT: Optional[int] = 2048
+
+    # Status of reading a pdf file as returned by read_pdf_safe, with the message shown instead of the statements
+    STATUS_MESSAGES = {
+        "ok": "",
+        "protected": "Could not read. File is protected.",
+        "timeout": "Could not read. Timed out.",
+        "memory": "Could not read. Memory limit exceeded.",
+        "error": "Could not read. File is damaged or not supported.",
+        "crashed": "Could not read. Worker process crashed."
+    }
+
+    # Cache of the texts and statements of pdf files, see ExtractCache
+    USE_CACHE = True
+    CACHE_FILE = "cache.sqlite"
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+    # Seconds between checks for worker processes that died while reading a file
+    WATCHDOG_INTERVAL = 1.0
+
+    _pool = None
+    _pool_lost_jobs = False
+    _started_queue = None
+    _cache = None
 
     # @timeit
     @staticmethod
-    def read_pdf(filename: str) -> str:
+    def read_pdf(filename: str, max_pages: Optional[int] = None, early_exit: Optional[bool] = None,
+                 engine: Optional[str] = None, stats: Optional[Dict[str, float]] = None) -> str:
         """
         Code taken from @RattleyCooper and @Trenton McKinney at
         https://stackoverflow.com/questions/26494211/extracting-text-from-a-pdf-file-using-pdfminer-in-python
 
-        Read content of pdf file to string
+        Read content of pdf file to string. At most max_pages pages are read. If early_exit is set, reading stops
+        as soon as the pages read so far are found to contain everything that is extracted (see is_extraction_complete).
 
         :param filename: relative or absolute path of input pdf file
+        :param max_pages: maximum number of pages read, MAX_PAGES if None
+        :param early_exit: whether or not to stop reading early, EARLY_EXIT if None
+        :param engine: text extraction engine, one of ENGINES, ENGINE if None
+        :param stats: Dictionary the durations of opening the file ("open") and reading its pages ("layout"), the number
+        of pages read ("pages") and the file size ("bytes") are written to, see Metrics
         :return: content of input pdf file as text
         """
+        stats = {} if stats is None else stats
+        stats.update({"open": 0.0, "layout": 0.0, "pages": 0, "bytes": os.path.getsize(filename), "status": "ok"})
+        start = perf_counter()
+
+        max_pages = GMSExtract.MAX_PAGES if max_pages is None else max_pages
+        early_exit = GMSExtract.EARLY_EXIT if early_exit is None else early_exit
+        engine = GMSExtract.ENGINE if engine is None else engine
 
         resource_manager = PDFResourceManager()
-        params = LAParams()
         output_string = StringIO()
         codec = 'utf-8'
-        device = TextConverter(resource_manager, output_string, codec=codec, laparams=params)
+        if engine == "fast":
+            device = FastTextConverter(resource_manager, output_string, codec=codec, laparams=None)
+        elif engine == "layout":
+            device = TextConverter(resource_manager, output_string, codec=codec, laparams=LAParams())
+        else:
+            raise ValueError(f"Unknown engine '{engine}'. Expected one of {', '.join(GMSExtract.ENGINES)}.")
         interpreter = PDFPageInterpreter(resource_manager, device)
 
-        fp = open(filename, 'rb')
         page_numbers = set()
         caching = True
         password = ""
-        max_pages = 12
 
-        try:
+        with open(filename, 'rb') as fp:
+            try:
+                for page in PDFPage.get_pages(fp, page_numbers, maxpages=max_pages, password=password,
+                                              caching=caching, check_extractable=True):
+                    if stats["pages"] == 0:
+                        stats["open"] = perf_counter() - start
+                    page_start = perf_counter()
 
-            for page in PDFPage.get_pages(fp, page_numbers, maxpages=max_pages, password=password, caching=caching,
-                                          check_extractable=True):
-                interpreter.process_page(page)
-        except PDFTextExtractionNotAllowed:
-            # print("Could not read " + filename + " : File is protected.")
-            return ""
+                    interpreter.process_page(page)
+
+                    stats["layout"] += perf_counter() - page_start
+                    stats["pages"] += 1
+
+                    if early_exit and GMSExtract.is_extraction_complete(output_string.getvalue()):
+                        break
+            except PDFTextExtractionNotAllowed:
+                # print("Could not read " + filename + " : File is protected.")
+                stats["open"] = perf_counter() - start
+                stats["status"] = "protected"
+                return ""
 
         content_text = output_string.getvalue()
 
-        fp.close()
         device.close()
         output_string.close()
 
         return content_text
 
+    @staticmethod
+    def is_extraction_complete(string: str) -> bool:
+        """
+        Check whether the given beginning of a safety data sheet contains everything that is extracted: The H-/P-/EUH-
+        Statements are listed in section 2, so section 2 is complete once a later section has begun. The WGK is
+        usually listed in section 15, so it must have been found as well.
+
+        :param string: text of the pages of a safety data sheet read so far
+        :return: whether or not reading further pages can be skipped
+        """
+        sections = map(int, GMSExtract.section_pattern.findall(string))
+        if not any(section > 2 for section in sections):
+            return False
+
+        return GMSExtract.scan(string)[-1] != ""
+
+    @staticmethod
+    def get_pool() -> Pool:
+        """
+        Get the worker pool used for reading pdf files. The pool is created on first use, capped at the number of
+        available CPUs and kept alive until close_pool is called, so it can be reused for multiple inputs. Workers are
+        limited to MEMORY_LIMIT and replaced after MAX_TASKS_PER_CHILD chunks of files.
+
+        :return: shared worker pool
+        """
+        if GMSExtract._pool is None:
+            GMSExtract._started_queue = SimpleQueue()  # Written without a feeder thread, which could fail to start
+            GMSExtract._pool = Pool(GMSExtract.MAX_WORKERS, initializer=GMSExtract.init_worker,
+                                    initargs=(GMSExtract.MEMORY_LIMIT, GMSExtract._started_queue),
+                                    maxtasksperchild=GMSExtract.MAX_TASKS_PER_CHILD)
+
+        return GMSExtract._pool
+
+    @staticmethod
+    def init_worker(memory_limit: Optional[int], started_queue) -> None:
+        """
+        Set up a worker process: Keep the queue the worker reports started files to (see read_pdf_unordered) and limit
+        the address space, so a pdf file that needs too much memory raises a MemoryError instead of exhausting the
+        memory of the machine
+
+        :param memory_limit: address space limit in megabytes, None for no limit
+        :param started_queue: queue the position of each file in the input and the process id are put to when reading
+        the file starts
+        """
+        GMSExtract._started_queue = started_queue
+
+        if memory_limit is None or resource is None:
+            return
+
+        limit = memory_limit * 1024 * 1024
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        if hard_limit != resource.RLIM_INFINITY:
+            limit = min(limit, hard_limit)
+
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+    @staticmethod
+    def close_pool() -> None:
+        """
+        Shut down the shared worker pool, if it was created
+        """
+        if GMSExtract._pool is not None:
+            if GMSExtract._pool_lost_jobs:
+                # Jobs of crashed workers never finish, so the pool can not be closed regularly
+                GMSExtract._pool.terminate()
+            else:
+                GMSExtract._pool.close()
+            GMSExtract._pool.join()
+            GMSExtract._pool = None
+            GMSExtract._pool_lost_jobs = False
+            GMSExtract._started_queue = None
+
+    @staticmethod
+    def read_pdf_safe(filename: str, max_pages: Optional[int] = None, early_exit: Optional[bool] = None,
+                      engine: Optional[str] = None, timeout: Optional[float] = None,
+                      stats: Optional[Dict[str, float]] = None) -> str:
+        """
+        Read content of pdf file to string as described in read_pdf, but never raise an exception. Instead, the
+        outcome is written to stats["status"] as one of the keys of STATUS_MESSAGES and the error message, if any, to
+        stats["error"].
+
+        :param filename: relative or absolute path of input pdf file
+        :param max_pages: maximum number of pages read, MAX_PAGES if None
+        :param early_exit: whether or not to stop reading early, EARLY_EXIT if None
+        :param engine: text extraction engine, one of ENGINES, ENGINE if None
+        :param timeout: seconds after which reading is aborted (Unix only), None for no limit
+        :param stats: Dictionary the statistics of read_pdf and the status are written to
+        :return: content of input pdf file as text, empty if it could not be read
+        """
+        stats = {} if stats is None else stats
+        use_timer = timeout is not None and hasattr(signal, "SIGALRM")
+
+        if use_timer:
+            previous_handler = signal.signal(signal.SIGALRM, raise_read_timeout)
+
+        try:
+            try:
+                try:
+                    if use_timer:
+                        signal.setitimer(signal.ITIMER_REAL, timeout)
+                    return GMSExtract.read_pdf(filename, max_pages, early_exit, engine, stats)
+                finally:
+                    # Turned off before any of the handlers below run, so they can not be interrupted
+                    if use_timer:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+            except ReadTimeout:
+                stats.update({"status": "timeout", "error": f"Reading took longer than {timeout}s."})
+            except MemoryError:
+                stats.update({"status": "memory", "error": "Memory limit exceeded."})
+            except Exception as error:
+                stats.update({"status": "error", "error": f"{error.__class__.__name__}: {error}"})
+        except ReadTimeout:
+            # The alarm was delivered late, while the outcome of reading was handled
+            stats.update({"status": "timeout", "error": f"Reading took longer than {timeout}s."})
+        finally:
+            if use_timer:
+                signal.signal(signal.SIGALRM, previous_handler)
+
+        return ""
+
+    @staticmethod
+    def read_pdf_indexed(task: Tuple[int, str, int, bool, str, Optional[float]]) -> Tuple[int, str, Dict[str, float]]:
+        """
+        Read content of pdf file to string as described in read_pdf_safe, keeping track of the file's position in the
+        input. The settings are passed along explicitly, as changes to the class attributes do not reach running
+        workers.
+
+        :param task: Tuple of the position of the file in the input, its path, max_pages, early_exit, engine and
+        timeout
+        :return: Tuple of the position of the file in the input, its content as text and the statistics of read_pdf
+        including the status
+        """
+        index, filename, max_pages, early_exit, engine, timeout = task
+        stats: Dict[str, float] = {}
+
+        if GMSExtract._started_queue is not None:
+            GMSExtract._started_queue.put((index, os.getpid()))
+
+        content = GMSExtract.read_pdf_safe(filename, max_pages, early_exit, engine, timeout, stats)
+
+        return index, content, stats
+
+    @staticmethod
+    def read_pdf_stream(filenames: Iterable[str], metrics: Optional[Metrics] = None, count: Optional[int] = None) \
+            -> Iterator[Tuple[str, str]]:
+        """
+        Read contents of all files in filenames as described in read_pdf_safe, yielding each content as soon as it and
+        all contents of the files before it are available. Contents finished out of order are held back in a reorder
+        buffer, so the order of filenames is preserved. A file that can not be read does not stop the others.
+
+        :param filenames: Filenames and paths to pdf files, taken only as they are dispatched to the workers
+        :param metrics: Metrics the statistics of each file are added to
+        :param count: Expected number of files, see read_pdf_unordered
+        :return: Iterator over the status (see STATUS_MESSAGES) and content of each of the passed pdf files
+        """
+        metrics = Metrics() if metrics is None else metrics
+        if count is None and isinstance(filenames, Sized):
+            count = len(filenames)
+
+        filenames = iter(filenames)
+        first_filenames = list(islice(filenames, 2))
+
+        if not GMSExtract.USE_MULTIPROCESSING or len(first_filenames) <= 1:
+            for filename in chain(first_filenames, filenames):
+                stats: Dict[str, float] = {}
+                content = GMSExtract.read_pdf_safe(filename, timeout=GMSExtract.FILE_TIMEOUT, stats=stats)
+                metrics.add_document(filename, stats)
+
+                yield stats["status"], content
+            return
+
+        dispatched_filenames: List[str] = []
+
+        def tasks() -> Iterator[Tuple[int, str, int, bool, str, Optional[float]]]:
+            for filename in chain(first_filenames, filenames):
+                dispatched_filenames.append(filename)
+                yield (len(dispatched_filenames) - 1, filename, GMSExtract.MAX_PAGES, GMSExtract.EARLY_EXIT,
+                       GMSExtract.ENGINE, GMSExtract.FILE_TIMEOUT)
+
+        pending: Dict[int, Tuple[str, str]] = {}
+        next_index = 0
+
+        for index, content, stats in GMSExtract.read_pdf_unordered(tasks(), count):
+            metrics.add_document(dispatched_filenames[index], stats)
+            pending[index] = (stats["status"], content)
+
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+
+    @staticmethod
+    def read_pdf_unordered(tasks: Iterable[Tuple[int, str, int, bool, str, Optional[float]]],
+                           count: Optional[int] = None) -> Iterator[Tuple[int, str, Dict[str, float]]]:
+        """
+        Read the files of all tasks in the worker pool as described in read_pdf_indexed, yielding the results in the
+        order they are finished. The tasks are taken from tasks in chunks and dispatched while the results are
+        consumed, at most MAX_WORKERS * CHUNKS_PER_WORKER chunks ahead of the first unfinished task. So a slow file
+        holds back a bounded number of results only, and tasks may still be produced while the first files are read.
+
+        Workers report each file they start reading. If a worker process dies while reading a file (e.g. killed by
+        the operating system), the pool would wait for its result forever. Instead, the file is reported with status
+        "crashed" and the other files of its chunk are dispatched again. A worker that is still reading a file twice
+        as long after its timeout is killed, e.g. when stuck outside of Python code or on platforms without the timer of
+        read_pdf_safe. The file is reported with status "timeout".
+
+        :param tasks: Tasks as expected by read_pdf_indexed
+        :param count: Expected number of tasks, used to choose the chunk size. Defaults to the length of tasks, if
+        known, otherwise the files are dispatched one by one
+        :return: Iterator over the results of read_pdf_indexed
+        """
+        pool = GMSExtract.get_pool()
+        started_queue = GMSExtract._started_queue
+        finished_queue = queue.Queue()
+
+        if count is None:
+            count = len(tasks) if isinstance(tasks, Sized) else 0
+        tasks = iter(tasks)
+
+        tasks_by_index: Dict[int, Tuple[int, str, int, bool, str, Optional[float]]] = {}
+        chunk_of: Dict[int, List[int]] = {}
+        remaining: Set[int] = set()
+        started: Dict[int, Tuple[int, float]] = {}  # position -> process id and start time, for unfinished files
+        worker_gone: Dict[int, float] = {}  # process id -> time the worker was first found missing
+        killed: Set[int] = set()
+        workers: Set[int] = set()
+        idle_deaths = 0  # workers that died without starting a file since the last progress
+
+        def dispatch(chunk: List[int]) -> None:
+            for index in chunk:
+                chunk_of[index] = chunk
+
+            def chunk_failed(error: BaseException) -> None:
+                # Errors outside of read_pdf_safe (e.g. while sending the results) fail the whole chunk
+                finished_queue.put([(index, "", {"status": "error", "error": f"{type(error).__name__}: {error}"})
+                                    for index in chunk])
+
+            pool.map_async(GMSExtract.read_pdf_indexed, [tasks_by_index[index] for index in chunk],
+                           chunksize=len(chunk), callback=finished_queue.put, error_callback=chunk_failed)
+
+        def finish(index: int) -> None:
+            remaining.discard(index)
+            started.pop(index, None)
+            tasks_by_index.pop(index, None)
+            chunk_of.pop(index, None)
+
+        chunk_size = max(1, min(count // (GMSExtract.MAX_WORKERS * GMSExtract.CHUNKS_PER_WORKER),
+                                GMSExtract.MAX_CHUNK_SIZE))
+        window = GMSExtract.MAX_WORKERS * GMSExtract.CHUNKS_PER_WORKER * chunk_size
+        taken: List[int] = []  # positions of the tasks in the order they were taken
+        first_unfinished = 0  # number of taken tasks before the first one that is still remaining
+        exhausted = False
+
+        while True:
+            while first_unfinished < len(taken) and taken[first_unfinished] not in remaining:
+                first_unfinished += 1
+
+            while not exhausted and len(taken) < first_unfinished + window:
+                chunk = []
+                for task in islice(tasks, chunk_size):
+                    tasks_by_index[task[0]] = task
+                    chunk.append(task[0])
+                exhausted = len(chunk) < chunk_size
+
+                if len(chunk) > 0:
+                    taken.extend(chunk)
+                    remaining.update(chunk)
+                    dispatch(chunk)
+
+            if len(remaining) == 0:
+                return
+
+            try:
+                results = finished_queue.get(timeout=GMSExtract.WATCHDOG_INTERVAL)
+            except queue.Empty:
+                results = []
+
+            for index, content, stats in results:
+                if index in remaining:
+                    finish(index)
+                    idle_deaths = 0
+                    yield index, content, stats
+
+            while not started_queue.empty():
+                index, process_id = started_queue.get()
+                if index in remaining:
+                    started[index] = (process_id, time())
+                    idle_deaths = 0
+
+            alive = {process.pid for process in active_children()}
+            busy = {process_id for process_id, _ in started.values()}
+            idle_deaths += len(workers - alive - busy)
+            workers = alive | busy
+
+            if idle_deaths > 2 * GMSExtract.MAX_WORKERS:
+                # Workers die before they can read any file (e.g. MEMORY_LIMIT below the size of the interpreter)
+                GMSExtract._pool_lost_jobs = True
+                for index in chain(sorted(remaining), (task[0] for task in tasks)):
+                    yield index, "", {"status": "crashed", "error": "Worker processes died before reading the file."}
+                return
+
+            lost_chunks: Dict[int, List[int]] = {}
+
+            for index, (process_id, start_time) in list(started.items()):
+                timeout = tasks_by_index[index][5]
+
+                if process_id in alive:
+                    if timeout is not None and time() - start_time > 2 * timeout:
+                        try:
+                            # SIGTERM terminates the process on Windows, which has no SIGKILL
+                            os.kill(process_id, getattr(signal, "SIGKILL", signal.SIGTERM))
+                        except OSError:
+                            # Exited in the meantime
+                            pass
+                        killed.add(index)
+                    continue
+
+                # Give the result of a worker that exited regularly (see MAX_TASKS_PER_CHILD) time to arrive
+                worker_gone.setdefault(process_id, time())
+                if time() - worker_gone[process_id] < 2 * GMSExtract.WATCHDOG_INTERVAL:
+                    continue
+
+                lost_chunks[id(chunk_of[index])] = chunk_of[index]
+
+            for chunk in lost_chunks.values():
+                GMSExtract._pool_lost_jobs = True
+
+                # A chunk is read in order by a single worker, so the last started file caused the crash and the
+                # results of the files before it were lost along with it
+                crashed_index = [index for index in chunk if index in started][-1]
+                for index in chunk:
+                    started.pop(index, None)
+                lost = [index for index in chunk if index in remaining and index != crashed_index]
+                finish(crashed_index)
+
+                if crashed_index in killed:
+                    yield crashed_index, "", {"status": "timeout", "error": "Worker process did not respond and was "
+                                                                            "killed."}
+                else:
+                    yield crashed_index, "", {"status": "crashed", "error": "Worker process died while reading the "
+                                                                            "file."}
+
+                if len(lost) > 0:
+                    dispatch(lost)
+
     @staticmethod
     # @timeit
     def read_pdf_multiple(filenames: List[str]) -> List[str]:
@@ -125,20 +824,149 @@ class GMSExtract:
         Read contents of all files in filenames
 
         :param filenames: List containing filenames and paths to pdf files
-        :return: List containing the contents of each of the passed pdf files as strings
+        :return: List containing the contents of each of the passed pdf files as strings, empty if it could not be read
         """
-        file_contents: List[str] = []
+        return [content for status, content in GMSExtract.read_pdf_stream(filenames)]
 
-        if GMSExtract.USE_MULTIPROCESSING:
-            with Pool(len(filenames)) as executor:
-                file_contents = executor.map(GMSExtract.read_pdf, filenames)
+    @staticmethod
+    def get_cache() -> Optional[ExtractCache]:
+        """
+        Get the cache of texts and statements of pdf files. The cache is opened on first use and kept open until
+        close_cache is called.
 
-            return file_contents
+        :return: shared cache, None if USE_CACHE is not set
+        """
+        if GMSExtract._cache is None and GMSExtract.USE_CACHE:
+            GMSExtract._cache = ExtractCache(GMSExtract.CACHE_FILE, GMSExtract.CACHE_MAX_BYTES)
+
+        return GMSExtract._cache
+
+    @staticmethod
+    def close_cache() -> None:
+        """
+        Close the shared cache, if it was opened
+        """
+        if GMSExtract._cache is not None:
+            GMSExtract._cache.close()
+            GMSExtract._cache = None
+
+    @staticmethod
+    def text_version() -> str:
+        """
+        :return: version stamp of the settings that change the text returned by read_pdf
+        """
+        return f"{GMSExtract.ENGINE}:{GMSExtract.MAX_PAGES}:{GMSExtract.EARLY_EXIT}:" \
+               f"{GMSExtract.section_pattern.pattern}"
+
+    @staticmethod
+    def result_version() -> str:
+        """
+        :return: version stamp of the patterns that change the statements returned by process
+        """
+        return hashlib.sha256(GMSExtract.scan_pattern.pattern.encode("utf-8")).hexdigest()
 
-        for filename in filenames:
-            file_contents.append(GMSExtract.read_pdf(filename))
+    @staticmethod
+    def extract_stream(filenames: List[str], metrics: Optional[Metrics] = None) \
+            -> Iterator[Tuple[str, Tuple[List[str], List[str], List[str], List[str], str]]]:
+        """
+        Read all files in filenames and find their statements as described in the process method, in the order of
+        filenames. Files found in the cache are neither read nor processed again, all others are read in parallel as
+        described in read_pdf_stream and added to the cache. For files that could not be read, the statements consist
+        of the status message only (see STATUS_MESSAGES).
+
+        :param filenames: List containing filenames and paths to pdf files
+        :param metrics: Metrics the durations of hashing, cache access, reading and processing each file are added to
+        :return: Iterator over the status and statements of each of the passed pdf files
+        """
+        metrics = Metrics() if metrics is None else metrics
+        cache = GMSExtract.get_cache()
+
+        if cache is None:
+            for filename, (status, string) in zip(filenames, GMSExtract.read_pdf_stream(filenames, metrics)):
+                if status not in ("ok", "protected"):
+                    yield status, GMSExtract.failed_result(status)
+                    continue
+
+                with metrics.measure("process", filename):
+                    result = GMSExtract.process(string)
 
-        return file_contents
+                yield status, result
+            return
+
+        text_version, result_version = GMSExtract.text_version(), GMSExtract.result_version()
+        file_hashes: List[str] = []
+        cached: List[bool] = []
+
+        def look_up(position: int) -> None:
+            # Files are hashed and looked up in the cache in order, as far as needed by either loop below
+            while len(file_hashes) <= position:
+                filename = filenames[len(file_hashes)]
+                with metrics.measure("hash", filename):
+                    file_hashes.append(ExtractCache.file_hash(filename))
+                with metrics.measure("cache", filename):
+                    cached.append(cache.contains(file_hashes[-1], text_version))
+
+        def uncached_filenames() -> Iterator[str]:
+            # Taken by the workers as they are free, so the first files are read while the others are still hashed
+            for position, filename in enumerate(filenames):
+                look_up(position)
+                if not cached[position]:
+                    yield filename
+
+        uncached_texts = GMSExtract.read_pdf_stream(uncached_filenames(), metrics, len(filenames))
+
+        for position, filename in enumerate(filenames):
+            look_up(position)
+            file_hash = file_hashes[position]
+
+            if cached[position]:
+                with metrics.measure("cache", filename):
+                    text, result = cache.get(file_hash, text_version, result_version)
+
+                if text is None:
+                    # Evicted by the files added since it was looked up. It was not passed to the workers, so it is
+                    # read here instead
+                    stats: Dict[str, float] = {}
+                    text = GMSExtract.read_pdf_safe(filename, timeout=GMSExtract.FILE_TIMEOUT, stats=stats)
+                    metrics.add_document(filename, stats)
+                    status = stats["status"]
+
+                    if status not in ("ok", "protected"):
+                        yield status, GMSExtract.failed_result(status)
+                        continue
+                else:
+                    metrics.add_document(filename, {"cached": True, "bytes": os.path.getsize(filename)})
+                    # Only files that could be read or are protected are cached
+                    status = "ok" if text != "" else "protected"
+            else:
+                text, result = None, None
+
+            if result is not None:
+                yield status, result
+                continue
+
+            if text is None:
+                status, text = next(uncached_texts)
+
+                if status not in ("ok", "protected"):
+                    # Do not cache failures, they may be caused by the load of the machine
+                    yield status, GMSExtract.failed_result(status)
+                    continue
+
+            with metrics.measure("process", filename):
+                result = GMSExtract.process(text)
+            with metrics.measure("cache", filename):
+                cache.put(file_hash, text_version, text, result_version, result)
+
+            yield status, result
+
+    @staticmethod
+    def failed_result(status: str) -> Tuple[List[str], List[str], List[str], List[str], str]:
+        """
+        :param status: status of a file that could not be read, one of the keys of STATUS_MESSAGES
+        :return: statements in the format of process consisting of the status message only
+        """
+        return [], [GMSExtract.STATUS_MESSAGES[status]], [], [], ""
 
     @staticmethod
     # @timeit
@@ -221,6 +1049,41 @@ class GMSExtract:
 
         return (cas_sum % 10) == checksum
 
+    @staticmethod
+    # @timeit
+    def scan(string: str) -> Tuple[List[str], List[str], List[str], List[str], str]:
+        """
+        Find all matches for CAS-Numbers, H-/P-/EUH-Statements and WGK (Wassergefährdungsklasse) in the given input
+        string in a single pass. The result is the same as normalizing the string and applying match_cas, match_h,
+        match_p, match_euh and match_wgk to it.
+
+        :param string: input string containing H-/P-/EUH-Statements, WGK and CAS-Numbers, need not be normalized
+        :return: lists of unique CAS-Numbers and H-/P-/EUH-Statements as described in the designated methods and WGK
+        """
+        matches = {"cas": set(), "h": set(), "p": set(), "euh": set()}
+        # End of the last accepted match of each kind, as findall would not return overlapping matches of one kind
+        match_ends = {"cas": 0, "h": 0, "p": 0, "euh": 0}
+        wgk, wassergefaehrdungsklasse = "", ""
+
+        for match in GMSExtract.scan_pattern.finditer(string):
+            kind = match.lastgroup
+
+            if kind in match_ends:
+                if match.start() < match_ends[kind]:
+                    continue
+
+                match_ends[kind] = match.end(kind)
+                matches[kind].add(GMSExtract.plus_pattern.sub(" + ", match.group(kind)))
+            elif kind == "wgk" and wgk == "":
+                wgk = match.group(kind)
+            elif kind == "WGK" and wassergefaehrdungsklasse == "":
+                wassergefaehrdungsklasse = match.group(kind)
+
+        cas_match = sorted(filter(GMSExtract.is_cas_valid, matches["cas"]))
+
+        return cas_match, sorted(matches["h"]), sorted(matches["p"]), sorted(matches["euh"]), \
+            wgk or wassergefaehrdungsklasse
+
     @staticmethod
     # @timeit
     def process(string: str) -> Tuple[List[str], List[str], List[str], List[str], str]:
@@ -235,15 +1098,7 @@ class GMSExtract:
             h_match = ["Could not read. File is protected."]
             return [], h_match, [], [], ""
 
-        normalized_string: str = GMSExtract.normalize_string(string)
-
-        h_match = GMSExtract.match_h(normalized_string)
-        p_match = GMSExtract.match_p(normalized_string)
-        euh_match = GMSExtract.match_euh(normalized_string)
-        wgk_match = GMSExtract.match_wgk(normalized_string)
-        cas_match = GMSExtract.match_cas(normalized_string)
-
-        return cas_match, h_match, p_match, euh_match, wgk_match
+        return GMSExtract.scan(string)
 
     @staticmethod
     # @timeit
@@ -344,15 +1199,31 @@ class GMSExtract:
 
         return "\n".join(found_statements)
 
+    @staticmethod
+    def string_excel_stream(matches: Iterable[Tuple[List[str], List[str], List[str], List[str], str]],
+                            filenames: List[str]) -> Iterator[str]:
+        """
+        Create the output line of each input file/text as described in the string_excel method, one input file/text
+        at a time. Only the current input is kept in memory.
+
+        :param matches: Iterable of the statements of each input file/text as returned by process
+        :param filenames: List containing all input filenames.
+        :return: Iterator over the formatted output line of each input file/text
+        """
+        for match, filename in zip(matches, filenames):
+            output_string, found = GMSExtract.string_excel(*match, filename)
+            yield output_string
+
 
-def get_input() -> Tuple[List[str], List[str]]:
+def get_input() -> Tuple[Iterable[Tuple[List[str], List[str], List[str], List[str], str]], List[str]]:
     """
     Read text from input prompt until an empty line is sent and the input up to this point is non-empty.
     If the text input is recognized to be a path to a pdf file, there will be an attempt to open the file
-    and return its contents as text. If the attempt fails or no path was recognized, the input text will
-    be returned.
+    and find the statements in its contents. If the attempt fails or no path was recognized, the statements
+    will be found in the input text.
 
-    :return: Tuple of a list of the plain input texts or contents of passed pdf file(s) as text and the filenames
+    :return: Tuple of the statements found in the plain input text or an iterator over the statements found in the
+    passed pdf file(s) as returned by GMSExtract.process and the filenames
     """
     input_buffer = ""
 
@@ -364,6 +1235,8 @@ def get_input() -> Tuple[List[str], List[str]]:
         if input_read == "quit":
             print("\nExit keyword detected. Terminating.")
             out_file.close()
+            GMSExtract.close_pool()
+            GMSExtract.close_cache()
             sys.exit(0)
 
         input_read = input("> ")
@@ -387,20 +1260,215 @@ def get_input() -> Tuple[List[str], List[str]]:
 
             file_list = sorted(file_list, key=str.casefold)
 
-            return GMSExtract.read_pdf_multiple(file_list), file_list
+            return (match for status, match in GMSExtract.extract_stream(file_list)), file_list
         except FileNotFoundError:
             print("File could not be found. Interpreting input as plain text.")
-    return [input_buffer], [""]
+    return [GMSExtract.process(input_buffer)], [""]
+
+
+OUTPUT_FORMATS = ("tsv", "csv", "jsonl")
+OUTPUT_COLUMNS = ("file", "cas", "h", "p", "euh", "wgk", "status")
+
+
+def collect_pdf_files(inputs: List[str]) -> List[str]:
+    """
+    Find all pdf files given by the inputs. Directories are searched recursively, all other inputs are interpreted as
+    glob patterns ('**' matches any number of subdirectories).
+
+    :param inputs: List containing paths to directories and glob patterns of pdf files
+    :return: sorted List containing the paths of all found pdf files without duplicates
+    """
+    file_list: Set[str] = set()
+
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                file_list.update(os.path.join(directory, filename) for filename in filenames
+                                 if filename.lower().endswith(".pdf"))
+        else:
+            file_list.update(filename for filename in glob(path, recursive=True)
+                             if filename.lower().endswith(".pdf") and os.path.isfile(filename))
+
+    return sorted(file_list, key=str.casefold)
+
+
+def get_output_format(output: str, output_format: Optional[str]) -> str:
+    """
+    Determine the format of the output file
+
+    :param output: path of the output file
+    :param output_format: explicitly requested format, one of OUTPUT_FORMATS, or None to use the file extension
+    :return: one of OUTPUT_FORMATS, "tsv" if the file extension is unknown
+    """
+    if output_format is not None:
+        return output_format
+
+    extension = output.split(".")[-1].lower()
+    return extension if extension in OUTPUT_FORMATS else "tsv"
+
+
+def read_output_files(output: str, output_format: str) -> Set[str]:
+    """
+    Read the names of all files that already have a row in the output file
+
+    :param output: path of the output file
+    :param output_format: format of the output file, one of OUTPUT_FORMATS
+    :return: Set containing the paths of the files listed in the output file, empty if the file does not exist
+    """
+    if not os.path.isfile(output):
+        return set()
+
+    with open(output, "r", encoding="utf-8", newline="") as in_stream:
+        if output_format == "jsonl":
+            done_files = set()
+            for line in in_stream:
+                try:
+                    done_files.add(json.loads(line)["file"])
+                except (ValueError, KeyError, TypeError):
+                    # Empty lines and the last line of an interrupted run, which may have been written partially. Its
+                    # file is processed again
+                    pass
+            return done_files
+
+        reader = csv.reader(in_stream, delimiter="," if output_format == "csv" else "\t")
+        return {row[0] for row in reader if len(row) > 0 and list(row) != list(OUTPUT_COLUMNS)}
+
+
+def write_output_row(out_stream: TextIO, output_format: str, filename: str, status: str,
+                     match: Tuple[List[str], List[str], List[str], List[str], str]) -> None:
+    """
+    Write the statements found in a file as one row of the output file. For files that could not be read, the
+    statements are left empty and only the status is written.
+
+    :param out_stream: opened output file
+    :param output_format: format of the output file, one of OUTPUT_FORMATS
+    :param filename: path of the file the statements were taken from
+    :param status: status of reading the file, one of the keys of GMSExtract.STATUS_MESSAGES
+    :param match: statements as returned by GMSExtract.process
+    """
+    cas_match, h_match, p_match, euh_match, wgk = match if status == "ok" else ([], [], [], [], "")
+
+    if output_format == "jsonl":
+        out_stream.write(json.dumps(dict(zip(OUTPUT_COLUMNS, (filename, cas_match, h_match, p_match, euh_match, wgk,
+                                                              status))), ensure_ascii=False) + "\n")
+        return
+
+    writer = csv.writer(out_stream, delimiter="," if output_format == "csv" else "\t")
+    writer.writerow([filename, ", ".join(cas_match), ", ".join(h_match), ", ".join(p_match), ", ".join(euh_match),
+                     wgk, status])
+
+
+def run_batch(inputs: List[str], output: str, output_format: Optional[str] = None,
+              metrics_file: Optional[str] = None) -> int:
+    """
+    Find the statements in all pdf files given by the inputs without user interaction and append them to the output
+    file. Files already listed in the output file are skipped. A summary of the timings is printed at the end.
+
+    :param inputs: List containing paths to directories and glob patterns of pdf files, see collect_pdf_files
+    :param output: path of the output file
+    :param output_format: format of the output file, one of OUTPUT_FORMATS, or None to use the file extension
+    :param metrics_file: path of a JSON file the timings of the batch and each file are written to
+    :return: number of processed files
+    """
+    metrics = Metrics()
+    output_format = get_output_format(output, output_format)
+    done_files = read_output_files(output, output_format)
+    found_files = collect_pdf_files(inputs)
+    file_list = [filename for filename in found_files if filename not in done_files]
+
+    print(f"Found {len(found_files)} pdf files, {len(file_list)} not yet in {output}.")
+
+    write_header = output_format != "jsonl" and not (os.path.isfile(output) and os.path.getsize(output) > 0)
+
+    # A run that was interrupted while writing a row leaves it without line break, the new rows start on a new line
+    partial_row = False
+    if not write_header and os.path.isfile(output) and os.path.getsize(output) > 0:
+        with open(output, "rb") as in_stream:
+            in_stream.seek(-1, os.SEEK_END)
+            partial_row = in_stream.read(1) not in (b"\n", b"\r")
+
+    with open(output, "a", encoding="utf-8", newline="") as out_stream:
+        if partial_row:
+            out_stream.write("\n")
+        if write_header:
+            csv.writer(out_stream, delimiter="," if output_format == "csv" else "\t").writerow(OUTPUT_COLUMNS)
+
+        for number, (filename, (status, match)) in enumerate(zip(file_list,
+                                                                 GMSExtract.extract_stream(file_list, metrics))):
+            with metrics.measure("write", filename):
+                write_output_row(out_stream, output_format, filename, status, match)
+                out_stream.flush()
+
+            error = metrics.documents.get(filename, {}).get("error")
+            print(f"[{number + 1}/{len(file_list)}] {filename}" + (f": {status} ({error})" if error else ""))
+
+    metrics.print_summary()
+    if metrics_file is not None:
+        metrics.write_json(metrics_file)
+
+    return len(file_list)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extract H-/P-/EUH-Statements, WGK and CAS-Numbers from safety data "
+                                                 "sheets. Without inputs, text or paths are read interactively.")
+    parser.add_argument("inputs", nargs="*",
+                        help="directories (searched recursively) and glob patterns of pdf files to process without "
+                             "user interaction")
+    parser.add_argument("-o", "--output", default="out.tsv",
+                        help="output file for processing inputs; files already listed in it are skipped "
+                             "(default: %(default)s)")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS,
+                        help="format of the output file (default: derived from its extension, otherwise tsv)")
+    parser.add_argument("-j", "--workers", type=int, default=GMSExtract.MAX_WORKERS,
+                        help="number of worker processes for reading pdf files (default: %(default)s)")
+    parser.add_argument("--engine", choices=GMSExtract.ENGINES, default=GMSExtract.ENGINE,
+                        help="text extraction engine for pdf files: 'layout' uses the layout analysis of pdfminer, "
+                             "'fast' skips it (default: %(default)s)")
+    parser.add_argument("--max-pages", type=int, default=GMSExtract.MAX_PAGES,
+                        help="maximum number of pages read per pdf file (default: %(default)s)")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="stop reading a pdf file once section 2 is complete and a WGK was found")
+    parser.add_argument("--timeout", type=float, default=GMSExtract.FILE_TIMEOUT,
+                        help="seconds after which reading a pdf file is aborted, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--memory-limit", type=int, default=GMSExtract.MEMORY_LIMIT,
+                        help="memory limit of each worker process in megabytes, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=GMSExtract.MAX_TASKS_PER_CHILD,
+                        help="number of chunks of files after which a worker process is replaced "
+                             "(default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="neither use nor update the cache")
+    parser.add_argument("--metrics", help="JSON file the timings of the batch and each file are written to")
+    arguments = parser.parse_args()
+
+    if arguments.workers < 1:
+        parser.error("argument -j/--workers: must be at least 1")
+    if arguments.max_tasks_per_child < 1:
+        parser.error("argument --max-tasks-per-child: must be at least 1")
+
+    GMSExtract.ENGINE = arguments.engine
+    GMSExtract.MAX_WORKERS = arguments.workers
+    GMSExtract.MAX_PAGES = arguments.max_pages
+    GMSExtract.EARLY_EXIT = arguments.early_exit
+    GMSExtract.USE_CACHE = not arguments.no_cache
+    GMSExtract.FILE_TIMEOUT = arguments.timeout or None
+    GMSExtract.MEMORY_LIMIT = arguments.memory_limit or None
+    GMSExtract.MAX_TASKS_PER_CHILD = arguments.max_tasks_per_child
+
+    if len(arguments.inputs) > 0:
+        try:
+            run_batch(arguments.inputs, arguments.output, arguments.format, arguments.metrics)
+        finally:
+            GMSExtract.close_pool()
+            GMSExtract.close_cache()
+        sys.exit(0)
+
     # Clear contents of output file
     out_file = open("out.txt", "w+")
     out_file.close()
 
     try:
         while True:
-            text_inputs, input_files = get_input()
+            matches, input_files = get_input()
 
             # Only show file name without path in output
             input_files = list(map(lambda file: file.replace("/", "\\").split("\\")[-1], input_files))
@@ -409,8 +1477,9 @@ if __name__ == '__main__':
 
             print("\n" + "#" * 150 + "\n")
 
-            out_string = GMSExtract.string_excel_all(*GMSExtract.process_all(text_inputs), input_files)
-            print(out_string)
+            for out_string in GMSExtract.string_excel_stream(matches, input_files):
+                print(out_string, flush=True)
+                out_file.flush()
 
             print("\n" + "#" * 150 + "\n")
 
@@ -418,3 +1487,5 @@ if __name__ == '__main__':
     except Exception as error:
         print("Unhandled Exception:", error)
         out_file.close()
+        GMSExtract.close_pool()
+        GMSExtract.close_cache()
@@ -0,0 +1,419 @@
+"""
+Benchmarks for GMSExtract.
+
+scan: Generates synthetic safety data sheet text of several megabytes, checks that the single-pass scanner
+(GMSExtract.scan) returns exactly the same results as normalizing the text and running each matcher separately, and
+compares the time both approaches take.
+    > python benchmark.py scan
+    > python benchmark.py scan --size 8 --repetitions 5
+
+engines: Reads a corpus of pdf files with each text extraction engine, checks that all engines find the same
+statements and compares the time they take. Without a directory, a synthetic corpus is generated.
+    > python benchmark.py engines
+    > python benchmark.py engines path/to/safety_data_sheets
+
+cache: Checks that extract_stream returns the same statements with a cache that only holds a few texts, when files
+that were found in the cache are evicted by the files added before them (generated corpus, runs offline).
+    > python benchmark.py cache
+
+suite: Times normalize_string, process and string_excel_all on generated text of several sizes and statement
+densities, and read_pdf and read_pdf_multiple on generated pdf files of several page counts and with several numbers
+of worker processes. The results are appended to a JSON lines file together with the current git commit, and compared
+to the previous run recorded in that file, so regressions show up between versions. Runs offline.
+    > python benchmark.py suite
+    > python benchmark.py suite --quick --results benchmark_results.jsonl
+"""
+
+from GMSExtract import GMSExtract
+import GMSExtract as gmsextract_module
+from typing import Dict, List, Optional, Tuple
+from tempfile import TemporaryDirectory
+from multiprocessing import cpu_count
+from time import perf_counter, strftime
+from io import BytesIO
+from glob import glob
+import subprocess
+import platform
+import argparse
+import random
+import json
+import os
+
+FILLER = ["Sicherheitsdatenblatt", "gemäß", "Verordnung", "(EG)", "Nr.", "1907/2006", "ABSCHNITT", "Bezeichnung",
+          "des", "Stoffs", "bzw.", "Gemischs", "und", "Firma", "Unternehmens", "Gefahrenhinweis(e)",
+          "Sicherheitshinweis(e)", "Signalwort", "Achtung", "Gefahr", "Lagerklasse", "10", "-", "13", "Sonstige",
+          "Flüssigkeiten", "Einatmen", "von", "Staub/", "Rauch/", "Gas/", "Nebel/", "Dampf/", "Aerosol", "vermeiden.",
+          "Version", "6.3", "Überarbeitet", "am", "12.05.2022", "Seite", "2", "von", "11", "\n", "\n\n"]
+STATEMENTS = ["H225", "H315", "H319", "H335", "H360FD", "H300 + H310 + H330", "H301\n+ H311", "P210",
+              "P305 + P351 + P338", "P302+P352", "P403 +\nP233", "EUH066", "EUH201A", "EUH061", "67-64-1", "7732-18-5",
+              "50-00-0", "64-17-5", "12-34-5", "WGK 1", "WGK: 2", "Wassergefährdungsklasse 3"]
+
+
+def generate_text(size: int, density: float = 0.02, seed: int = 0) -> str:
+    """
+    Generate synthetic safety data sheet text
+
+    :param size: approximate length of the generated text in characters
+    :param density: share of words that are statements, CAS-Numbers or WGK information
+    :param seed: seed for the random number generator
+    :return: generated text
+    """
+    generator = random.Random(seed)
+    words: List[str] = []
+    length = 0
+
+    while length < size:
+        word = generator.choice(STATEMENTS) if generator.random() < density else generator.choice(FILLER)
+        words.append(word)
+        length += len(word) + 1
+
+    return " ".join(words)
+
+
+def generate_pdf(filename: str, pages: List[List[str]]) -> None:
+    """
+    Write a minimal pdf file containing the given lines of text, using only the standard Helvetica font
+
+    :param filename: path of the pdf file to be written
+    :param pages: List containing the lines of text of each page
+    """
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * page) for page in range(len(pages))) +
+        b"] /Count %d >>" % len(pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+    ]
+
+    for page, lines in enumerate(pages):
+        escaped_lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        content = ("BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) '" for line in escaped_lines) + " ET")
+        content = content.encode("cp1252", "replace")
+
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % (5 + 2 * page))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets: List[int] = []
+
+    for number, pdf_object in enumerate(objects):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % (number + 1) + pdf_object + b"\nendobj\n"
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(filename, "wb") as out_stream:
+        out_stream.write(output)
+
+
+def generate_corpus(directory: str, count: int, pages: int = 8, density: float = 0.02, seed: int = 0) -> List[str]:
+    """
+    Write synthetic safety data sheets as pdf files
+
+    :param directory: directory the pdf files are written to
+    :param count: number of pdf files
+    :param pages: number of pages per pdf file
+    :param density: share of words that are statements, CAS-Numbers or WGK information
+    :param seed: seed for the random number generator
+    :return: List containing the paths of the written pdf files
+    """
+    filenames: List[str] = []
+
+    for number in range(count):
+        lines = [line for section in range(1, pages * 2 + 1) for line in
+                 [f"ABSCHNITT {section}: Sicherheitsdatenblatt"] +
+                 generate_text(1500, density, seed * count + number * 100 + section).split("\n")]
+        # Wrap long lines like a pdf page would
+        lines = [line[start:start + 100] for line in lines for start in range(0, max(len(line), 1), 100)]
+        lines_per_page = -(-len(lines) // pages)
+
+        filename = os.path.join(directory, f"sds_{number:04d}.pdf")
+        generate_pdf(filename, [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)])
+        filenames.append(filename)
+
+    return filenames
+
+
+def process_separately(string: str) -> Tuple[List[str], List[str], List[str], List[str], str]:
+    """
+    Find all matches as GMSExtract.process did before the single-pass scanner: normalize the string and run each
+    matcher on its own.
+
+    :param string: input string containing H-/P-/EUH-Statements, WGK and CAS-Numbers
+    :return: lists of CAS-Numbers and H-/P-/EUH-Statements and WGK as returned by GMSExtract.process
+    """
+    normalized_string = GMSExtract.normalize_string(string)
+
+    return GMSExtract.match_cas(normalized_string), GMSExtract.match_h(normalized_string), \
+        GMSExtract.match_p(normalized_string), GMSExtract.match_euh(normalized_string), \
+        GMSExtract.match_wgk(normalized_string)
+
+
+def best_time(func, argument, repetitions: int) -> float:
+    """
+    Call func with argument repeatedly and measure the fastest call
+
+    :param func: function to be timed
+    :param argument: argument passed to func
+    :param repetitions: number of calls
+    :return: time of the fastest call in seconds
+    """
+    times: List[float] = []
+
+    for _ in range(repetitions):
+        start = perf_counter()
+        func(argument)
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def benchmark_scan(size_mb: int, repetitions: int) -> None:
+    """
+    Compare the single-pass scanner with the separate matchers on generated text and print the results
+
+    :param size_mb: size of the generated text in megabytes
+    :param repetitions: number of timed calls per approach
+    """
+    text = generate_text(size_mb * 1024 * 1024)
+
+    if GMSExtract.scan(text) != process_separately(text):
+        raise AssertionError("Single-pass scanner and separate matchers returned different results.")
+
+    separate = best_time(process_separately, text, repetitions)
+    single_pass = best_time(GMSExtract.scan, text, repetitions)
+
+    print(f"{size_mb} MB text, best of {repetitions}:")
+    print(f"\tnormalize + separate matchers: {separate:.3f}s")
+    print(f"\tsingle-pass scan:              {single_pass:.3f}s")
+    print(f"\tspeedup:                       {separate / single_pass:.2f}x")
+
+
+def benchmark_engines(filenames: List[str]) -> None:
+    """
+    Read the given pdf files with each text extraction engine, compare the found statements and print the results
+
+    :param filenames: List containing paths to pdf files
+    """
+    results: Dict[str, list] = {}
+
+    for engine in GMSExtract.ENGINES:
+        start = perf_counter()
+        texts = [GMSExtract.read_pdf(filename, engine=engine) for filename in filenames]
+        duration = perf_counter() - start
+
+        results[engine] = [GMSExtract.process(text) for text in texts]
+        print(f"{engine + ':':8}{duration:.3f}s for {len(filenames)} files ({duration / len(filenames) * 1000:.1f}ms "
+              f"per file)")
+
+    reference_engine = GMSExtract.ENGINES[0]
+    for engine in GMSExtract.ENGINES[1:]:
+        differences = [filename for filename, reference, result in
+                       zip(filenames, results[reference_engine], results[engine]) if reference != result]
+
+        print(f"{engine} finds the same statements as {reference_engine} in "
+              f"{len(filenames) - len(differences)} of {len(filenames)} files.")
+        for filename in differences:
+            print(f"\tDifferent statements in {filename}")
+
+
+def check_cache_eviction(directory: str, count: int = 8) -> None:
+    """
+    Check that extract_stream returns the statements of each file in order when files found in the cache are evicted
+    by files added during the same run: half of the files are cached first, then all files are extracted with the
+    cached ones last, using a cache that holds about half of the texts
+
+    :param directory: directory the generated pdf files and the cache are written to
+    :param count: number of generated pdf files
+    """
+    filenames = generate_corpus(directory, count)
+    cached_filenames, new_filenames = filenames[:count // 2], filenames[count // 2:]
+    settings = (GMSExtract.USE_CACHE, GMSExtract.CACHE_FILE, GMSExtract.CACHE_MAX_BYTES)
+
+    try:
+        GMSExtract.USE_CACHE = False
+        expected = dict(zip(filenames, GMSExtract.extract_stream(filenames)))
+
+        text_bytes = max(len(GMSExtract.read_pdf(filename).encode("utf-8")) for filename in filenames)
+        GMSExtract.USE_CACHE = True
+        GMSExtract.CACHE_FILE = os.path.join(directory, "cache.sqlite")
+        GMSExtract.CACHE_MAX_BYTES = int(text_bytes * (len(cached_filenames) + 0.5))
+
+        list(GMSExtract.extract_stream(cached_filenames))
+        GMSExtract.close_cache()
+
+        order = new_filenames + cached_filenames
+        results = list(GMSExtract.extract_stream(order))
+        GMSExtract.close_cache()
+    finally:
+        GMSExtract.USE_CACHE, GMSExtract.CACHE_FILE, GMSExtract.CACHE_MAX_BYTES = settings
+
+    if results != [expected[filename] for filename in order]:
+        raise AssertionError("extract_stream returned other statements after files were evicted from the cache.")
+    print(f"extract_stream returns the same statements for {len(order)} files with evictions from the cache.")
+
+
+def git_commit() -> str:
+    """
+    :return: hash of the checked out git commit, marked with '+' if there are uncommitted changes, empty if unknown
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+    return commit + ("+" if changes != "" else "")
+
+
+def benchmark_suite(quick: bool = False, repetitions: int = 3) -> List[Dict]:
+    """
+    Time the stages of GMSExtract on generated text and pdf files of several sizes
+
+    :param quick: use fewer and smaller inputs
+    :param repetitions: number of timed calls per text benchmark, the fastest is recorded
+    :return: List containing the name, parameters and time in seconds of each benchmark
+    """
+    results: List[Dict] = []
+
+    def record(name: str, seconds: float, **parameters) -> None:
+        results.append({"name": name, "parameters": parameters, "seconds": seconds})
+        print(f"{name:20}{', '.join(f'{key}={value}' for key, value in parameters.items()):40}{seconds * 1000:10.2f}ms")
+
+    sizes_kb = [64, 1024] if quick else [64, 1024, 4096]
+    densities = [0.02] if quick else [0.005, 0.02, 0.1]
+    documents = 100 if quick else 1000
+
+    # string_excel writes every output line to the output file of the interactive mode
+    gmsextract_module.out_file = BytesIO()
+
+    for size_kb in sizes_kb:
+        for density in densities:
+            text = generate_text(size_kb * 1024, density)
+            record("normalize_string", best_time(GMSExtract.normalize_string, text, repetitions),
+                   size_kb=size_kb, density=density)
+            record("process", best_time(GMSExtract.process, text, repetitions), size_kb=size_kb, density=density)
+
+            matches = GMSExtract.process_all([text])
+            batch = tuple(match * documents for match in matches) + ([f"sds_{number:04d}.pdf" for number in
+                                                                      range(documents)],)
+            record("string_excel_all", best_time(lambda values: GMSExtract.string_excel_all(*values), batch,
+                                                 repetitions), documents=documents, size_kb=size_kb, density=density)
+
+    page_counts = [2, 8] if quick else [2, 8, 16]
+    count = 4 if quick else 16
+    worker_counts = sorted({1, 2, cpu_count()}) if quick else sorted({1, 2, 4, cpu_count()})
+
+    with TemporaryDirectory() as directory:
+        for pages in page_counts:
+            corpus_directory = os.path.join(directory, str(pages))
+            os.makedirs(corpus_directory)
+            filenames = generate_corpus(corpus_directory, count, pages)
+
+            for engine in GMSExtract.ENGINES:
+                start = perf_counter()
+                for filename in filenames:
+                    GMSExtract.read_pdf(filename, engine=engine)
+                record("read_pdf", (perf_counter() - start) / count, pages=pages, engine=engine)
+
+        filenames = glob(os.path.join(directory, str(page_counts[-1]), "*.pdf"))
+        for workers in worker_counts:
+            GMSExtract.close_pool()
+            GMSExtract.MAX_WORKERS = workers
+            GMSExtract.get_pool()
+
+            start = perf_counter()
+            GMSExtract.read_pdf_multiple(filenames)
+            record("read_pdf_multiple", perf_counter() - start, files=count, pages=page_counts[-1], workers=workers)
+
+        GMSExtract.close_pool()
+
+    return results
+
+
+def record_results(results: List[Dict], results_file: str) -> Optional[Dict]:
+    """
+    Append the results of a benchmark suite run to a JSON lines file and print the change of each benchmark compared
+    to the previous run recorded in that file
+
+    :param results: results as returned by benchmark_suite
+    :param results_file: path of the JSON lines file
+    :return: previous run, None if there is none
+    """
+    previous: Optional[Dict] = None
+    if os.path.isfile(results_file):
+        with open(results_file, "r", encoding="utf-8") as in_stream:
+            lines = [line for line in in_stream if line.strip() != ""]
+        previous = json.loads(lines[-1]) if len(lines) > 0 else None
+
+    run = {
+        "time": strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpu_count": cpu_count(),
+        "results": results
+    }
+
+    with open(results_file, "a", encoding="utf-8") as out_stream:
+        out_stream.write(json.dumps(run) + "\n")
+
+    if previous is None:
+        print(f"\nRecorded results in {results_file}.")
+        return None
+
+    def key(result: Dict) -> str:
+        return result["name"] + json.dumps(result["parameters"], sort_keys=True)
+
+    previous_seconds = {key(result): result["seconds"] for result in previous["results"]}
+
+    print(f"\nChange compared to {previous['commit'] or 'unknown commit'} ({previous['time']}):")
+    for result in results:
+        if key(result) in previous_seconds and previous_seconds[key(result)] > 0:
+            change = result["seconds"] / previous_seconds[key(result)] - 1
+            parameters = ', '.join(f'{name}={value}' for name, value in result["parameters"].items())
+            print(f"{result['name']:20}{parameters:40}{change:+10.1%}")
+
+    return previous
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for GMSExtract.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_scan = subparsers.add_parser("scan", help="compare single-pass scanner and separate matchers")
+    parser_scan.add_argument("--size", type=int, default=4, help="size of the generated text in megabytes")
+    parser_scan.add_argument("--repetitions", type=int, default=5, help="number of timed calls per approach")
+
+    parser_engines = subparsers.add_parser("engines", help="compare text extraction engines")
+    parser_engines.add_argument("directory", nargs="?", help="directory containing pdf files, generated if omitted")
+    parser_engines.add_argument("--count", type=int, default=20, help="number of generated pdf files")
+
+    subparsers.add_parser("cache", help="check extract_stream with files evicted from the cache during a run")
+
+    parser_suite = subparsers.add_parser("suite", help="time all stages on generated inputs and record the results")
+    parser_suite.add_argument("--quick", action="store_true", help="use fewer and smaller inputs")
+    parser_suite.add_argument("--results", default="benchmark_results.jsonl",
+                              help="JSON lines file the results are appended to (default: %(default)s)")
+
+    arguments = parser.parse_args()
+
+    if arguments.benchmark == "scan":
+        benchmark_scan(arguments.size, arguments.repetitions)
+    elif arguments.benchmark == "cache":
+        with TemporaryDirectory() as directory:
+            check_cache_eviction(directory)
+    elif arguments.benchmark == "suite":
+        record_results(benchmark_suite(arguments.quick), arguments.results)
+    elif arguments.directory is not None:
+        benchmark_engines(sorted(glob(os.path.join(arguments.directory, "**", "*.[pP][dD][fF]"), recursive=True)))
+    else:
+        with TemporaryDirectory() as directory:
+            benchmark_engines(generate_corpus(directory, arguments.count))
@@ -10,6 +10,7 @@ from tkinter import Tk
 from openpyxl import load_workbook
 from openpyxl.worksheet.datavalidation import DataValidation  #
 from openpyxl.utils import get_column_letter
+from excel_utils import get_last_row
 import io
 # import time
 import datetime
@@ -102,12 +103,7 @@ print("\n" + "geprüfte Datei:" + "\n" + data + "\n")
 
 # Finde Index von letzter nicht-leeren Zeile
 max_col = ws.max_column
-for row_nr, row in enumerate(ws.iter_rows()):
-    if any([cell.value is not None for cell in row]):
-        max_row = row_nr
-        # print(row_nr, [(col_nr, cell.value, type(cell.value)) for col_nr, cell in enumerate(row) if cell.value is not None])
-    else:
-        pass
+max_row = get_last_row(ws) - 1
 
 # Header
 # print("max_row = " + str(max_row+1))
@@ -191,12 +187,7 @@ wb_ref = load_workbook(in_mem_file, data_only=True)
 ws_ref = wb_ref['Chemicals register']
 
 # Find max row in reference data
-max_row = ws_ref.max_row
-for row_nr, row in enumerate(ws_ref.iter_rows()):
-    if any([cell.value is not None for cell in row]):
-        max_row = row_nr
-    else:
-        pass
+max_row = get_last_row(ws_ref) - 1
 
 wgk_dict = {}
 wgk_dict_duplicates = []
@@ -0,0 +1,65 @@
+import hashlib
+from itertools import repeat
+from typing import Any, List, Optional
+from weakref import WeakKeyDictionary
+
+from openpyxl.worksheet.worksheet import Worksheet
+
+
+# Last used row of every worksheet that was looked at, dropped together with the worksheet
+_last_row_cache: "WeakKeyDictionary" = WeakKeyDictionary()
+
+
+def _get_cells(worksheet) -> Optional[dict]:
+    # All cells of a worksheet that was loaded completely are kept in memory, by (row, column). Looking at them directly
+    # neither builds the rows nor creates missing cells like iter_rows/cell would. This is not part of the public API of
+    # openpyxl, so other versions that keep the cells differently fall back to iter_rows
+    cells = getattr(worksheet, "_cells", None) if isinstance(worksheet, Worksheet) else None
+    return cells if isinstance(cells, dict) else None
+
+
+def _find_last_row(worksheet) -> int:
+    cells = _get_cells(worksheet)
+    if cells is not None:
+        return max((row for (row, _), cell in cells.items() if cell.value is not None), default=0)
+
+    # Read-only worksheets can only be streamed, once
+    last_row = 0
+    for row_nr, row in enumerate(worksheet.iter_rows(min_row=1, values_only=True), start=1):
+        for value in row:
+            if value is not None:
+                last_row = row_nr
+                break
+
+    return last_row
+
+
+def get_last_row(worksheet, refresh: bool = False) -> int:
+    # Number of the last row that contains a value (1-based, 0 for an empty worksheet). The result is cached per
+    # worksheet, use refresh=True after values were written below the previous last row
+    last_row: Optional[int] = None if refresh else _last_row_cache.get(worksheet)
+    if last_row is None:
+        last_row = _find_last_row(worksheet)
+        _last_row_cache[worksheet] = last_row
+
+    return last_row
+
+
+def get_column_values(worksheet, column: int, min_row: int, max_row: int) -> List[Any]:
+    # Values of the rows min_row to max_row of a column (1-based, inclusive), None for empty cells
+    cells = _get_cells(worksheet)
+    if cells is not None:
+        # Looked up in the cells of the worksheet directly, like in _find_last_row
+        column_cells = map(cells.get, zip(range(min_row, max_row + 1), repeat(column)))
+        return [None if cell is None else cell.value for cell in column_cells]
+
+    return [row[0] for row in worksheet.iter_rows(min_row=min_row, max_row=max_row, min_col=column, max_col=column,
+                                                  values_only=True)]
+
+
+def get_file_hash(filename) -> str:
+    file_hash = hashlib.sha256()
+    with open(filename, "rb") as in_stream:
+        for chunk in iter(lambda: in_stream.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()